@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import trace_core
+from catalog_core import CatalogIndex, fetch_catalog, app_folder, CATALOG_URL
+from package_store import PackageStore
+from mirror_core import mirrors
+from install_core import InstallQueue, InstallRegistry, MAX_PARALLEL_INSTALLS, DONE, FAILED
+
+# 進捗は1行1JSON（NDJSON）で標準出力へ書き出す
+PROGRESS_INTERVAL = 1.0
+
+_emit_lock = threading.Lock()
+
+
+def emit(event, **fields):
+    line = json.dumps({'event': event, 'time': round(time.time(), 3), **fields}, ensure_ascii=False)
+    with _emit_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+def load_catalog(args, registry):
+    try:
+        apps = fetch_catalog(args.url, offline=args.offline)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"カタログを取得できませんでした: {e}")
+    if apps is None:
+        raise SystemExit("カタログを取得できませんでした")
+    registry.reconcile([app_folder(a) for a in apps if a.get('type', 'app') == 'app'])
+    return apps
+
+
+def select(apps, registry, os_name=None, category=None, kind=None, installed=None, query=""):
+    index = CatalogIndex(apps, installed=lambda app: registry.is_installed(app_folder(app)))
+    keys = index.filter(os_name=os_name, category=category, kind=kind, installed=installed, query=query)
+    return [app for key, app in index.apps.items() if key in keys]
+
+
+def find_apps(apps, names):
+    found = []
+    for name in names:
+        matches = [a for a in apps if a.get('type', 'app') == 'app'
+                   and name in (a.get('id'), a['title'], app_folder(a))]
+        if not matches:
+            raise SystemExit(f"見つかりません: {name}")
+        found.extend(m for m in matches if m not in found)
+    return found
+
+
+def app_record(app, registry):
+    folder = app_folder(app)
+    entry = registry.get(folder) or {}
+    return {
+        'title': app['title'],
+        'id': app.get('id'),
+        'folder': folder,
+        'os': app.get('os', '全OS'),
+        'category': app.get('category', '未分類'),
+        'type': app.get('type', 'app'),
+        'version': app.get('version'),
+        'installed': registry.is_installed(folder),
+        'installed_version': entry.get('version'),
+    }
+
+
+def job_record(job):
+    return {'title': job.title, 'folder': job.folder, 'state': job.state, 'message': job.message,
+            'downloaded': job.downloaded, 'total': job.total,
+            'error': str(job.error) if job.error else None}
+
+
+# 並列にインストールし、すべて終わるまで進捗を書き出す
+def run_jobs(apps, registry, args, update=False):
+    if apps:
+        emit('mirrors', ranked=mirrors().probe())
+    queue = InstallQueue(workers=args.jobs, rate_limit=args.rate * 1024, registry=registry,
+                         store=PackageStore(),
+                         on_update=lambda job: emit('job', **job_record(job)))
+    jobs = []
+    for app in apps:
+        folder = app_folder(app)
+        manifest = app.get('manifest') if update and registry.is_installed(folder) else None
+        jobs.append(queue.submit(app['link'], folder, title=app['title'], version=app.get('version'),
+                                 rate_limit=args.job_rate * 1024, sha256=app.get('sha256'),
+                                 size=app.get('size'), manifest=manifest))
+    while any(job.active for job in jobs):
+        time.sleep(PROGRESS_INTERVAL)
+        for job in jobs:
+            if job.active and job.total:
+                emit('progress', title=job.title, downloaded=job.downloaded, total=job.total)
+    done = sum(job.state == DONE for job in jobs)
+    failed = sum(job.state == FAILED for job in jobs)
+    emit('summary', done=done, failed=failed, total=len(jobs))
+    return 1 if failed else 0
+
+
+def cmd_list(args, registry):
+    apps = select(load_catalog(args, registry), registry, os_name=args.os, category=args.category,
+                  installed=args.installed, query=args.query)
+    for app in apps:
+        emit('app', **app_record(app, registry))
+    return 0
+
+
+def cmd_install(args, registry):
+    apps = load_catalog(args, registry)
+    if args.all:
+        targets = select(apps, registry, os_name=args.os, category=args.category, kind='app',
+                         installed=False)
+    else:
+        targets = find_apps(apps, args.names)
+    targets = [a for a in targets if args.force or not registry.is_installed(app_folder(a))]
+    return run_jobs(targets, registry, args)
+
+
+def cmd_update_all(args, registry):
+    apps = select(load_catalog(args, registry), registry, os_name=args.os, category=args.category,
+                  kind='app', installed=True)
+    targets = [a for a in apps if registry.outdated(app_folder(a), a.get('version'))]
+    return run_jobs(targets, registry, args, update=True)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="app_cli", description="Team Hijikinoheya App Downloader (CLI)")
+    parser.add_argument('--dir', default='.', help="インストール先フォルダ")
+    parser.add_argument('--url', default=CATALOG_URL, help="カタログ(app.json)のURL")
+    parser.add_argument('--offline', action='store_true', help="保存済みのカタログだけを使う")
+    parser.add_argument('--trace', metavar='FILE', help="計測結果を Chrome トレース形式で書き出す")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def filters(p):
+        p.add_argument('--os', help="対応OSで絞り込む")
+        p.add_argument('--category', help="カテゴリで絞り込む")
+
+    def workers(p):
+        p.add_argument('-j', '--jobs', type=int, default=MAX_PARALLEL_INSTALLS, help="同時インストール数")
+        p.add_argument('--rate', type=int, default=0, help="帯域制限 (KB/s, 0=無制限)")
+        p.add_argument('--job-rate', type=int, default=0, help="1件ごとの帯域制限 (KB/s, 0=無制限)")
+
+    p = sub.add_parser('list', help="カタログを一覧表示する")
+    filters(p)
+    p.add_argument('--installed', action='store_true', default=None, help="インストール済みだけ")
+    p.add_argument('--not-installed', dest='installed', action='store_false', help="未インストールだけ")
+    p.add_argument('--query', default="", help="タイトル・説明で検索")
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser('install', help="アプリをインストールする")
+    p.add_argument('names', nargs='*', help="タイトル・ID・フォルダ名")
+    p.add_argument('--all', action='store_true', help="未インストールのアプリをすべて")
+    p.add_argument('--force', action='store_true', help="インストール済みでも入れ直す")
+    filters(p)
+    workers(p)
+    p.set_defaults(func=cmd_install)
+
+    p = sub.add_parser('update-all', help="バージョンが変わったアプリをすべて更新する")
+    filters(p)
+    workers(p)
+    p.set_defaults(func=cmd_update_all)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'install' and not args.names and not args.all:
+        raise SystemExit("インストールするアプリを指定してください（または --all）")
+    trace_path = os.path.abspath(args.trace) if args.trace else None
+    if trace_path:
+        trace_core.enable()
+    os.makedirs(args.dir, exist_ok=True)
+    os.chdir(args.dir)
+    registry = InstallRegistry().load()
+    try:
+        return args.func(args, registry)
+    finally:
+        if trace_path:
+            trace_core.export(trace_path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,95 +1,370 @@
 import sys
+import time
+_T0 = time.perf_counter()
 import os
 import json
 import subprocess
 import threading
-import time
-import zipfile
-import shutil
-import requests
-from PyQt5.QtCore import Qt, QUrl, QTimer, QObject, pyqtSignal, QSize
+from collections import OrderedDict, deque
+from PyQt5.QtCore import Qt, QUrl, QTimer, QObject, pyqtSignal, QSize, QFileSystemWatcher
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QPushButton,
     QVBoxLayout, QHBoxLayout, QScrollArea, QGroupBox, QMessageBox,
-    QComboBox, QMenuBar, QMenu, QAction, QSplashScreen, QProgressBar
+    QComboBox, QMenuBar, QMenu, QAction, QSplashScreen, QProgressBar, QSpinBox,
+    QListView, QStackedWidget, QLineEdit, QCheckBox, QTreeWidget, QTreeWidgetItem, QFileDialog
 )
-from PyQt5.QtGui import QPixmap, QIcon
-from PyQt5.QtWebEngineWidgets import QWebEngineView
+from PyQt5.QtGui import QPixmap, QIcon, QDesktopServices
 from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest
-from PyQt5.Qt import QDesktopServices
+import trace_core
+from trace_core import traced
+import net_core
+from mirror_core import mirrors
+from download_core import SpeedMeter, state_path
+from catalog_core import CatalogCache, CatalogIndex, CatalogStream, keyed_apps, DATA_DIR, CATALOG_URL
+from catalog_view import CatalogModel, CatalogFilter, CatalogDelegate, app_folder, download_label
+from package_store import PackageStore
+from file_ops import FileOperations
+from install_core import (
+    InstallQueue, InstallRegistry, MAX_PARALLEL_INSTALLS, QUEUED, RUNNING, PAUSED, DONE, FAILED, CANCELED
+)
 
 # 定数設定
-API_URL = "https://home.hijikinoheya.com/app/app.json"
+API_URL = CATALOG_URL
 LICENSE_URL = "https://home.hijikinoheya.com/license_page.php"
 HOMEPAGE_URL = "https://home.hijikinoheya.com"
 PAGE_BASE = "https://home.hijikinoheya.com/page/"
+STATUS_URL = "https://status.hijikinoheya.com/page/index.php"
+NEWS_URL = "https://home.hijikinoheya.com/news/page/index.php"
 LOGO_PATH = os.path.join(os.path.dirname(__file__), "logo.png")
 APP_TITLE = "Team Hijikinoheya App Downloader"
 APP_VERSION = "V1.0"
+PROGRESS_INTERVAL_MS = 250
+VIRTUAL_THRESHOLD = 500
+# 読み込み中に1回のイベント処理でまとめて描画する最大件数（最初のページは単独で描画する）
+FLUSH_LIMIT = 2000
+WATCH_INSTALL_DIR = True
+SERVER_CHECK_TIMEOUT_MS = 3000
+SPLASH_TIMEOUT_MS = 8000
+PREWARM_DELAY_MS = 3000
+# QtWebEngine の先読みと、ステータス・ニュースの事前読み込みは既定で無効
+# （Chromium の起動でメモリを使い、GUIスレッドも止まるため）。環境変数に 1 を指定すると有効になる
+PREWARM_WEB_ENGINE = os.environ.get("HIJIKINOHEYA_PREWARM_WEB") == "1"
+PRELOAD_WEB = os.environ.get("HIJIKINOHEYA_PRELOAD_WEB") == "1"
+MAX_WEB_VIEWS = 4
+WEB_CACHE_DIR = os.path.join(DATA_DIR, "web")
+WEB_CACHE_SIZE = 100 * 1024 * 1024
+PRELOAD_WEB_PAGES = [("ステータス", STATUS_URL), ("ニュース", NEWS_URL)]
+STARTUP_TIME_FLAG = "--startup-time"
+STARTUP_TIME_PATH = "startup_time.json"
+TRACE_PATH = os.path.join(DATA_DIR, "trace.json")
+LAG_INTERVAL_MS = 100
 
 class WebWindow(QMainWindow):
-    def __init__(self, title, url):
+    def __init__(self, title, url, profile=None):
         super().__init__()
         self.setWindowTitle(title)
         self.resize(1024, 768)
         # メインウィンドウのアイコン
         self.setWindowIcon(QIcon('icons.png'))
-        view = QWebEngineView()
-        view.load(QUrl(url))
-        self.setCentralWidget(view)
+        # QtWebEngine は重いので最初に開くときに読み込む
+        from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEnginePage
+        self.view = QWebEngineView()
+        if profile is not None:
+            self.view.setPage(QWebEnginePage(profile, self.view))
+        self.url = url
+        self.view.load(QUrl(url))
+        self.setCentralWidget(self.view)
 
-class DownloadWindow(QWidget):
-    def __init__(self, url, folder_name, parent=None):
-        super().__init__()
+    def load(self, url):
         self.url = url
-        self.folder_name = folder_name
-        self.parent = parent
-        self.zip_name = folder_name + ".zip"
-        self.setWindowTitle(f"ダウンロード: {folder_name}")
-        self.resize(500, 150)
+        self.view.load(QUrl(url))
+
+# タイトルごとに WebWindow を使い回し、ディスクキャッシュ付きのプロファイルを共有する
+# 閉じたウィンドウは非表示のまま残し、上限を超えたら古いものから破棄する
+class WebViewManager(QObject):
+    def __init__(self, parent=None, max_views=MAX_WEB_VIEWS):
+        super().__init__(parent)
+        self.max_views = max_views
+        self.windows = OrderedDict()
+        self._profile = None
+
+    def profile(self):
+        if self._profile is None:
+            from PyQt5.QtWebEngineWidgets import QWebEngineProfile
+            self._profile = QWebEngineProfile("hijikinoheya", self)
+            self._profile.setCachePath(os.path.join(WEB_CACHE_DIR, "cache"))
+            self._profile.setPersistentStoragePath(os.path.join(WEB_CACHE_DIR, "storage"))
+            self._profile.setHttpCacheType(QWebEngineProfile.DiskHttpCache)
+            self._profile.setHttpCacheMaximumSize(WEB_CACHE_SIZE)
+        return self._profile
+
+    def open(self, title, url, show=True):
+        win = self.windows.pop(title, None)
+        if win is None:
+            win = WebWindow(title, url, self.profile())
+        elif win.url != url:
+            win.load(url)
+        self.windows[title] = win
+        self.evict()
+        if show:
+            win.show()
+            win.raise_()
+            win.activateWindow()
+        return win
+
+    def preload(self, pages):
+        for title, url in pages:
+            if title not in self.windows:
+                self.open(title, url, show=False)
+
+    def evict(self):
+        while len(self.windows) > self.max_views:
+            hidden = [t for t, w in self.windows.items() if not w.isVisible()]
+            if not hidden:
+                return
+            win = self.windows.pop(hidden[0])
+            win.view.setPage(None)
+            win.deleteLater()
+
+class DownloadJobRow(QWidget):
+    STATE_TEXT = {
+        QUEUED: "待機中",
+        RUNNING: "ダウンロード中...",
+        PAUSED: "一時停止中",
+        DONE: "完了しました！",
+        FAILED: "中断しました。再開で続きから再開します",
+        CANCELED: "キャンセルしました",
+    }
+
+    def __init__(self, job, queue):
+        super().__init__()
+        self.job = job
+        self.queue = queue
+        self.meter = SpeedMeter()
         layout = QVBoxLayout(self)
-        self.label = QLabel("準備中...", self)
-        self.speed_label = QLabel("速度: 0 KB/s", self)
-        self.progress = QProgressBar(self)
-        layout.addWidget(self.label)
-        layout.addWidget(self.speed_label)
+        top = QHBoxLayout()
+        self.title = QLabel(f"<b>{job.title}</b>")
+        self.label = QLabel("準備中...")
+        self.speed_label = QLabel("速度: 0 KB/s")
+        top.addWidget(self.title)
+        top.addWidget(self.label)
+        top.addStretch()
+        top.addWidget(self.speed_label)
+        self.progress = QProgressBar()
+        buttons = QHBoxLayout()
+        self.pause_btn = QPushButton("一時停止")
+        self.pause_btn.clicked.connect(self.toggle_pause)
+        self.top_btn = QPushButton("優先")
+        self.top_btn.clicked.connect(lambda: self.queue.prioritize(self.job))
+        self.cancel_btn = QPushButton("キャンセル")
+        self.cancel_btn.clicked.connect(lambda: self.queue.cancel(self.job))
+        # このジョブだけの帯域制限（全体の制限とは別に効く）
+        buttons.addWidget(QLabel("上限 (KB/s, 0=無制限):"))
+        self.rate = QSpinBox()
+        self.rate.setRange(0, 1024 * 1024)
+        self.rate.setSingleStep(100)
+        self.rate.setValue(job.limiter.rate // 1024)
+        self.rate.valueChanged.connect(lambda v: self.job.limiter.set_rate(v * 1024))
+        buttons.addWidget(self.rate)
+        buttons.addStretch()
+        buttons.addWidget(self.pause_btn)
+        buttons.addWidget(self.top_btn)
+        buttons.addWidget(self.cancel_btn)
+        layout.addLayout(top)
         layout.addWidget(self.progress)
+        layout.addLayout(buttons)
+        self.refresh()
+
+    def toggle_pause(self):
+        if self.job.state in (PAUSED, FAILED):
+            self.queue.resume(self.job)
+        else:
+            self.queue.pause(self.job)
+
+    def refresh(self):
+        job = self.job
+        if job.state == RUNNING:
+            self.label.setText(job.message or self.STATE_TEXT[RUNNING])
+            self.update_progress()
+        else:
+            self.meter.reset()
+            self.label.setText(self.STATE_TEXT[job.state])
+        self.speed_label.setVisible(job.state == RUNNING)
+        if job.state == DONE:
+            self.progress.setValue(100)
+        elif job.total:
+            self.progress.setValue(int(job.downloaded * 100 / job.total))
+        self.pause_btn.setText("再開" if job.state in (PAUSED, FAILED) else "一時停止")
+        self.pause_btn.setEnabled(job.state in (QUEUED, RUNNING, PAUSED, FAILED))
+        self.top_btn.setEnabled(job.state == QUEUED)
+        self.cancel_btn.setEnabled(job.state in (QUEUED, RUNNING, PAUSED, FAILED))
+        self.rate.setEnabled(job.active)
+
+    # 受信量は QTimer から一定間隔で読み、速度は移動平均で表示する
+    def update_progress(self):
+        job = self.job
+        downloaded, total = job.downloaded, job.total
+        kb_s = int(self.meter.sample(downloaded) / 1024)
+        eta = self.meter.eta(downloaded, total)
+        text = f"速度: {kb_s} KB/s"
+        if eta is not None:
+            text += f"  残り {format_eta(eta)}"
+        self.speed_label.setText(text)
+        if total:
+            self.progress.setValue(int(downloaded * 100 / total))
+
+def format_eta(seconds):
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h}:{m:02}:{s:02}" if h else f"{m}:{s:02}"
+
+class DownloadQueueWindow(QWidget):
+    job_changed = pyqtSignal(object)
+    installed = pyqtSignal(object)
+
+    def __init__(self, registry=None, store=None):
+        super().__init__()
+        self.setWindowTitle("ダウンロード")
+        self.setWindowIcon(QIcon('icons.png'))
+        self.resize(600, 400)
+        self.rows = {}
+        self.queue = InstallQueue(workers=MAX_PARALLEL_INSTALLS, on_update=self.job_changed.emit,
+                                  registry=registry, store=store)
+        # ワーカースレッドからの通知はシグナル経由でGUIスレッドに渡す
+        self.job_changed.connect(self.on_job_changed)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update_progress)
+        self.timer.start(PROGRESS_INTERVAL_MS)
+
+        layout = QVBoxLayout(self)
+        header = QHBoxLayout()
+        header.addWidget(QLabel(f"同時ダウンロード数: {MAX_PARALLEL_INSTALLS}"))
+        header.addStretch()
+        header.addWidget(QLabel("帯域制限 (KB/s, 0=無制限):"))
+        self.rate = QSpinBox()
+        self.rate.setRange(0, 1024 * 1024)
+        self.rate.setSingleStep(100)
+        self.rate.valueChanged.connect(lambda v: self.queue.set_rate_limit(v * 1024))
+        header.addWidget(self.rate)
+        clear = QPushButton("完了を消去")
+        clear.clicked.connect(self.clear_finished)
+        header.addWidget(clear)
+        layout.addLayout(header)
+
+        self.container = QWidget()
+        self.vbox = QVBoxLayout(self.container)
+        self.vbox.setAlignment(Qt.AlignTop)
+        scroll = QScrollArea()
+        scroll.setWidgetResizable(True)
+        scroll.setWidget(self.container)
+        layout.addWidget(scroll)
+
+    def submit(self, url, folder, title=None, version=None, sha256=None, size=None, manifest=None):
+        job = self.queue.submit(url, folder, title=title, version=version, sha256=sha256, size=size,
+                                manifest=manifest)
+        self.on_job_changed(job)
         self.show()
-        threading.Thread(target=self._download_extract, daemon=True).start()
-
-    def _download_extract(self):
-        self.label.setText("ダウンロード中...")
-        resp = requests.get(self.url, stream=True)
-        total = int(resp.headers.get('content-length', 0))
-        downloaded = 0
-        start = time.time()
-        with open(self.zip_name, 'wb') as f:
-            for chunk in resp.iter_content(8192):
-                if not chunk:
-                    continue
-                f.write(chunk)
-                downloaded += len(chunk)
-                elapsed = time.time() - start
-                kb_s = int(downloaded / 1024 / elapsed) if elapsed > 0 else 0
-                self.speed_label.setText(f"速度: {kb_s} KB/s")
-                self.progress.setValue(int(downloaded * 100 / total))
-        if zipfile.is_zipfile(self.zip_name):
-            self.label.setText("Zipを解凍中...")
-            with zipfile.ZipFile(self.zip_name, 'r') as z:
-                z.extractall(self.folder_name)
-            sub = os.path.join(self.folder_name, os.path.basename(self.folder_name))
-            if os.path.isdir(sub):
-                for item in os.listdir(sub):
-                    shutil.move(os.path.join(sub, item), self.folder_name)
-                shutil.rmtree(sub)
-            os.remove(self.zip_name)
-        self.label.setText("完了しました！")
-        self.speed_label.hide()
-        self.progress.setValue(100)
-        if self.parent:
-            QTimer.singleShot(0, self.parent.reload_apps)
+        self.raise_()
+        return job
+
+    def on_job_changed(self, job):
+        row = self.rows.get(job)
+        if row is None:
+            row = DownloadJobRow(job, self.queue)
+            self.rows[job] = row
+            self.vbox.addWidget(row)
+        row.refresh()
+        if job.state == DONE and not getattr(row, 'notified', False):
+            row.notified = True
+            self.installed.emit(job)
+
+    def update_progress(self):
+        for job, row in self.rows.items():
+            if job.state == RUNNING:
+                row.update_progress()
+
+    def clear_finished(self):
+        self.queue.clear_finished()
+        for job, row in list(self.rows.items()):
+            if job not in self.queue.jobs:
+                row.setParent(None)
+                del self.rows[job]
+
+# 計測結果（区間ごとの回数・時間とカウンター）の表示と、Chrome トレース形式での書き出し
+class DiagnosticsWindow(QWidget):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("診断")
+        self.setWindowIcon(QIcon('icons.png'))
+        self.resize(640, 420)
+        layout = QVBoxLayout(self)
+        header = QHBoxLayout()
+        self.enabled = QCheckBox("計測を有効にする")
+        self.enabled.setChecked(trace_core.enabled)
+        self.enabled.toggled.connect(self.set_enabled)
+        header.addWidget(self.enabled)
+        header.addStretch()
+        for text, slot in (("更新", self.refresh), ("クリア", self.clear), ("書き出し...", self.export)):
+            btn = QPushButton(text)
+            btn.clicked.connect(slot)
+            header.addWidget(btn)
+        layout.addLayout(header)
+        self.table = QTreeWidget()
+        self.table.setHeaderLabels(["区間 / カウンター", "回数", "合計 (ms)", "平均 (ms)", "最大 (ms)"])
+        self.table.setRootIsDecorated(False)
+        layout.addWidget(self.table)
+        # イベントループの遅れ（タイマーが予定より何ms遅れて呼ばれたか）
+        self.lag_timer = QTimer(self)
+        self.lag_timer.timeout.connect(self.sample_lag)
+        self.lag_last = None
+        self.set_enabled(trace_core.enabled)
+
+    def set_enabled(self, value):
+        trace_core.enable(value)
+        self.lag_last = None
+        if value:
+            self.lag_timer.start(LAG_INTERVAL_MS)
+        else:
+            self.lag_timer.stop()
+
+    def sample_lag(self):
+        now = time.perf_counter()
+        if self.lag_last is not None:
+            lag = (now - self.lag_last) * 1000 - LAG_INTERVAL_MS
+            trace_core.counter('event_loop', lag_ms=round(max(0, lag), 1))
+        self.lag_last = now
+
+    def showEvent(self, event):
+        self.refresh()
+        super().showEvent(event)
+
+    def refresh(self):
+        spans, counters = trace_core.summary()
+        self.table.clear()
+        for name, s in sorted(spans.items(), key=lambda kv: -kv[1]['total_ms']):
+            QTreeWidgetItem(self.table, [name, str(s['count']), f"{s['total_ms']:.1f}",
+                                         f"{s['total_ms'] / s['count']:.2f}", f"{s['max_ms']:.1f}"])
+        for name, values in sorted(counters.items()):
+            text = ", ".join(f"{k}={v}" for k, v in values.items())
+            QTreeWidgetItem(self.table, [name, "", text, "", ""])
+        for i in range(self.table.columnCount()):
+            self.table.resizeColumnToContents(i)
+
+    def clear(self):
+        trace_core.clear()
+        self.refresh()
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "トレースを書き出す", "trace.json", "Chrome トレース (*.json)")
+        if path:
+            trace_core.export(path)
 
 class AppDownloader(QMainWindow):
+    catalog_ready = pyqtSignal()
+    catalog_shown = pyqtSignal()
+    catalog_page = pyqtSignal(int, object)
+    catalog_done = pyqtSignal(int, object, object)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle(f"{APP_TITLE} - {APP_VERSION}")
@@ -111,6 +386,12 @@ class AppDownloader(QMainWindow):
         ]
         for name, url in pages:
             other.addAction(name, lambda chk, u=url, n=name: self.open_web(n, u))
+        view_menu = menubar.addMenu("表示")
+        self.act_virtual = view_menu.addAction("軽量リスト表示")
+        self.act_virtual.setCheckable(True)
+        self.act_virtual.toggled.connect(lambda _: (self.populate(), self.filter_items(None)))
+        view_menu.addAction("診断...", lambda: (self.diagnostics.show(), self.diagnostics.raise_()))
+        menubar.addAction("ダウンロード", lambda: (self.downloads.show(), self.downloads.raise_()))
         menubar.addAction("リロード", self.reload_apps)
 
         header = QWidget()
@@ -121,8 +402,8 @@ class AppDownloader(QMainWindow):
         hbox.addWidget(lbl_logo)
         hbox.addStretch()
         btns = [
-            ("ステータス", "https://status.hijikinoheya.com/page/index.php"),
-            ("ニュース", "https://home.hijikinoheya.com/news/page/index.php"),
+            ("ステータス", STATUS_URL),
+            ("ニュース", NEWS_URL),
             ("ライセンス", LICENSE_URL)
         ]
         for txt, link in btns:
@@ -140,72 +421,349 @@ class AppDownloader(QMainWindow):
         hbox.addWidget(self.combo_os)
         hbox.addWidget(QLabel("カテゴリ:"))
         hbox.addWidget(self.combo_cat)
+        self.combo_state = QComboBox()
+        self.combo_state.addItems(["すべて", "インストール済み", "未インストール"])
+        self.combo_state.currentTextChanged.connect(self.filter_items)
+        hbox.addWidget(self.combo_state)
+        self.search = QLineEdit()
+        self.search.setPlaceholderText("検索")
+        self.search.setClearButtonEnabled(True)
+        self.search.textChanged.connect(self.filter_items)
+        hbox.addWidget(self.search)
 
         self.container = QWidget()
         self.vbox = QVBoxLayout(self.container)
         self.vbox.setAlignment(Qt.AlignTop)
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        scroll.setWidget(self.container)
+        self.scroll = QScrollArea()
+        self.scroll.setWidgetResizable(True)
+        self.scroll.setWidget(self.container)
+        # 件数が多いときは表示中の行だけ描画するリストに切り替える
+        self.registry = InstallRegistry().load()
+        self.partials = self.scan_partials()
+        self.model = CatalogModel(self, installed=self.is_installed, updatable=self.has_update,
+                                  resumable=self.has_partial)
+        self.proxy = CatalogFilter(self)
+        self.proxy.setSourceModel(self.model)
+        self.delegate = CatalogDelegate(self)
+        self.delegate.clicked.connect(self.on_entry_action)
+        self.list_view = QListView()
+        self.list_view.setModel(self.proxy)
+        self.list_view.setItemDelegate(self.delegate)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setVerticalScrollMode(QListView.ScrollPerPixel)
+        self.stack = QStackedWidget()
+        self.stack.addWidget(self.scroll)
+        self.stack.addWidget(self.list_view)
         main_layout = QVBoxLayout()
         main_layout.addWidget(header)
-        main_layout.addWidget(scroll)
+        main_layout.addWidget(self.stack)
         central = QWidget()
         central.setLayout(main_layout)
         self.setCentralWidget(central)
 
-        self.manager = QNetworkAccessManager()
-        self.manager.finished.connect(self.on_data)
+        self.catalog_page.connect(self.on_page)
+        self.catalog_done.connect(self.on_data)
+        self.generation = 0
+        self.fetch_lock = threading.Lock()
+        self.pages = deque()
+        self.progressive = False
+        self.loaded = None
+        self.refreshed = None
+        self.flush_scheduled = False
+        self.complete = False  # 最後まで読み込んだ一覧を表示しているか
         self.apps = []
+        self.index = CatalogIndex()
         self.groups = {}
-        QTimer.singleShot(0, self.load_data)
+        self.entries = {}
+        self.web = WebViewManager(self)
+        self.downloads = DownloadQueueWindow(self.registry, PackageStore())
+        self.downloads.installed.connect(lambda job: self.refresh_installed())
+        self.downloads.job_changed.connect(self.on_job_state)
+        self.diagnostics = DiagnosticsWindow()
+        self.file_ops = FileOperations(self)
+        self.file_ops.finished.connect(self.on_file_op)
+        self.file_ops.cleanup(self.registry.root)
+        # インストール先の外部での変更を監視して台帳に反映する
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(500)
+        self.watch_timer.timeout.connect(self.reconcile_installed)
+        if WATCH_INSTALL_DIR:
+            self.watcher = QFileSystemWatcher([self.registry.root], self)
+            self.watcher.directoryChanged.connect(lambda _: self.watch_timer.start())
+        self.catalog_cache = CatalogCache(url=API_URL)
+        QTimer.singleShot(0, lambda: self.load_data(use_cache=True))
 
     def open_web(self, title, url):
-        win = WebWindow(title, url)
-        win.show()
-        setattr(self, f"_win_{title}", win)
+        self.web.open(title, url)
 
     def reload_apps(self):
         self.resize(self._init_size)
+        self.refresh_installed()
         self.load_data()
 
-    def load_data(self):
-        self.manager.get(QNetworkRequest(QUrl(API_URL)))
+    def refresh_installed(self):
+        if self.apps:
+            self.index.refresh_installed(self.is_installed)
+            self.populate()
+            self.filter_items(None)
 
-    def on_data(self, reply):
-        if reply.error():
+    def is_installed(self, app):
+        return self.registry.is_installed(app_folder(app))
+
+    # 差分更新用のマニフェストがあり、インストール済みのバージョンと違う
+    def has_update(self, app):
+        return bool(app.get('manifest')) and self.registry.outdated(app_folder(app), app.get('version'))
+
+    # 途中までのダウンロードは起動時に1回だけ探し、以降はジョブの状態から更新する
+    def scan_partials(self):
+        suffix = state_path(".zip")
+        try:
+            names = os.listdir(self.registry.root)
+        except OSError:
+            return set()
+        return {self.registry.key(n[:-len(suffix)]) for n in names if n.endswith(suffix)}
+
+    def has_partial(self, app):
+        return self.registry.key(app_folder(app)) in self.partials
+
+    def on_job_state(self, job):
+        if job.manifest or job.state in (QUEUED, RUNNING):
+            return
+        key = self.registry.key(job.folder)
+        # 状態が変わったときだけファイルを確認する（接続前の失敗では途中経過が残らない）
+        partial = job.state in (PAUSED, FAILED) and os.path.exists(state_path(key + ".zip"))
+        if partial == (key in self.partials):
+            return
+        if partial:
+            self.partials.add(key)
+        else:
+            self.partials.discard(key)
+        if self.use_virtual():
+            self.model.refresh_state()
+        else:
+            for w in self.entries.values():
+                if w.buttons is not None and self.registry.key(w.folder) == key:
+                    self.refresh_entry(w)
+
+    def reconcile_installed(self):
+        folders = [app_folder(a) for a in self.apps if a.get('type','app') == 'app']
+        if self.registry.reconcile(folders):
+            self.refresh_installed()
+
+    # 取得と解析は別スレッドで行い、PAGE_SIZE 件ずつシグナルで受け取る
+    # use_cache=True なら前回のカタログを先に読み、その後サーバーで再検証する
+    @traced('catalog.load_data')
+    def load_data(self, use_cache=False):
+        self.generation += 1
+        self.pages.clear()
+        if self.progressive or not self.complete:
+            # 途中までの一覧は捨て、保存済みのカタログから読み直す（再検証が 304 なら本文は届かない）
+            self.apps = []
+            self.index = CatalogIndex(installed=self.is_installed)
+            self.clear_entries()
+            self.model.set_apps([])
+            use_cache = True
+        self.progressive = False
+        self.loaded = None
+        self.refreshed = None
+        threading.Thread(target=self.fetch_data, args=(self.generation, use_cache), daemon=True).start()
+
+    def fetch_data(self, generation, use_cache):
+        with self.fetch_lock:
+            if use_cache:
+                apps = []
+                with trace_core.span('catalog.cache'):
+                    for page in self.catalog_cache.load_pages():
+                        apps.extend(page)
+                        self.catalog_page.emit(generation, page)
+                if apps or self.catalog_cache.body is not None:
+                    self.catalog_done.emit(generation, apps, None)
+            stream = CatalogStream(API_URL, self.catalog_cache)
+            try:
+                with trace_core.span('catalog.fetch', url=API_URL):
+                    for page in stream.pages():
+                        self.catalog_page.emit(generation, page)
+            except Exception as e:
+                self.catalog_done.emit(generation, None, e)
+                return
+            # 304 や内容が同じ場合は再描画しない
+            self.catalog_done.emit(generation, stream.apps if stream.changed else None, None)
+
+    # 一覧が空のときだけ、届いたページから順に表示する
+    # 表示中の一覧がある場合は読み終えてから差分だけ反映する
+    def on_page(self, generation, page):
+        if generation != self.generation or self.loaded is not None:
+            return
+        if not self.progressive:
+            if self.apps:
+                return
+            self.progressive = True
+            self.apps = []
+            self.index = CatalogIndex(installed=self.is_installed)
+        self.pages.append(page)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            QTimer.singleShot(0, self.flush_pages)
+
+    # 1回のイベント処理で描画する量を抑え、その間に画面の更新や操作を受け付ける
+    def flush_pages(self):
+        self.flush_scheduled = False
+        if not self.progressive:
+            return
+        if self.pages:
+            page = self.pages.popleft()
+            if self.apps:
+                while self.pages and len(page) < FLUSH_LIMIT:
+                    page = page + self.pages.popleft()
+            self.show_page(page)
+        if self.pages:
+            self.schedule_flush()
+        elif self.loaded is not None:
+            self.finish_loading()
+
+    # 読み込み中は件数によらず軽量リストに追加していき、表示方法は読み終えてから決める
+    @traced('catalog.show_page')
+    def show_page(self, page):
+        first = not self.apps
+        keys = self.index.add(page)
+        self.apps.extend(page)
+        self.update_combos()
+        if first:
+            self.clear_entries()
+            self.model.set_apps([])
+            self.stack.setCurrentWidget(self.list_view)
+        self.model.append_apps(page, keys)
+        if self.filtering():
+            self.filter_items(None)
+        if first:
+            self.catalog_shown.emit()
+
+    def finish_loading(self):
+        error = self.loaded[0]
+        self.progressive = False
+        self.complete = error is None
+        self.loaded = None
+        if self.registry.reconcile([app_folder(a) for a in self.apps if a.get('type','app') == 'app']):
+            self.index.refresh_installed(self.is_installed)
+        self.populate()
+        self.filter_items(None)
+        if error is not None:
+            self.statusBar().showMessage("データ取得失敗: 途中までの一覧を表示しています", 5000)
+        self.catalog_ready.emit()
+        if self.refreshed is not None:
+            apps, error = self.refreshed
+            self.refreshed = None
+            self.on_data(self.generation, apps, error)
+
+    @traced('catalog.on_data')
+    def on_data(self, generation, apps, error):
+        if generation != self.generation:
+            return
+        if self.progressive:
+            # 残りのページを描画し終えてから仕上げる（その間に届いた再検証の結果は後で反映する）
+            if self.loaded is None:
+                self.loaded = (error,)
+                self.schedule_flush()
+            else:
+                self.refreshed = (apps, error)
+            return
+        if error is not None:
+            if self.apps:
+                self.statusBar().showMessage("データ取得失敗: 保存済みの一覧を表示しています", 5000)
+                return
+            self.catalog_ready.emit()
             QMessageBox.critical(self, "Error", "データ取得失敗")
             return
-        self.apps = json.loads(bytes(reply.readAll()).decode('utf-8'))
-        self.combo_os.clear()
-        self.combo_os.addItem("すべてのOS")
-        self.combo_cat.clear()
-        self.combo_cat.addItem("すべてのカテゴリ")
-        oss, cats = set(), set()
-        for app in self.apps:
-            oss.add(app.get('os','全OS'))
-            cats.add(app.get('category','未分類'))
-        for o in sorted(oss):
-            self.combo_os.addItem(o)
-        for c in sorted(cats):
-            self.combo_cat.addItem(c)
+        if apps is None and not self.complete:
+            apps = self.catalog_cache.load()
+        if apps is not None:
+            self.show_catalog(apps)
+
+    @traced('catalog.show_catalog')
+    def show_catalog(self, apps):
+        self.apps = apps
+        self.complete = True
+        self.registry.reconcile([app_folder(a) for a in apps if a.get('type','app') == 'app'])
+        self.index = CatalogIndex(apps, installed=self.is_installed)
+        self.update_combos()
         self.populate()
+        self.filter_items(None)
+        self.catalog_shown.emit()
+        self.catalog_ready.emit()
+
+    def update_combos(self):
+        if len(self.index.by_os) != self.combo_os.count() - 1:
+            self.fill_combo(self.combo_os, "すべてのOS", sorted(self.index.by_os))
+        if len(self.index.by_category) != self.combo_cat.count() - 1:
+            self.fill_combo(self.combo_cat, "すべてのカテゴリ", sorted(self.index.by_category))
 
+    def fill_combo(self, combo, all_text, items):
+        # 再読み込みしても選択中の項目は維持する
+        current = combo.currentText()
+        combo.blockSignals(True)
+        combo.clear()
+        combo.addItem(all_text)
+        combo.addItems(items)
+        combo.setCurrentIndex(max(0, combo.findText(current)))
+        combo.blockSignals(False)
+
+    def use_virtual(self):
+        return self.act_virtual.isChecked() or len(self.apps) >= VIRTUAL_THRESHOLD
+
+    # 前回の一覧との差分だけ行を追加・削除・更新する
+    @traced('catalog.populate')
     def populate(self):
-        for i in reversed(range(self.vbox.count())):
-            w = self.vbox.itemAt(i).widget()
-            if w:
+        if self.use_virtual():
+            self.clear_entries()
+            self.model.set_apps(self.apps)
+            self.stack.setCurrentWidget(self.list_view)
+            return
+        self.model.set_apps([])
+        self.stack.setCurrentWidget(self.scroll)
+        apps = keyed_apps(self.apps)
+        for key in list(self.entries):
+            w = self.entries[key]
+            app = apps.get(key)
+            if app is None or app.get('category','未分類') != w.app.get('category','未分類'):
                 w.setParent(None)
-        self.groups.clear()
-        for app in self.apps:
+                del self.entries[key]
+        for key, app in apps.items():
+            w = self.entries.get(key)
+            if w is not None and w.app == app:
+                self.refresh_entry(w)
+                continue
             cat = app.get('category','未分類')
             if cat not in self.groups:
                 box = QGroupBox(cat)
                 box.setLayout(QVBoxLayout())
                 self.groups[cat] = box
                 self.vbox.addWidget(box)
-            self.add_entry(self.groups[cat].layout(), app)
+            layout = self.groups[cat].layout()
+            new = self.add_entry(layout, app)
+            if w is not None:
+                # 内容が変わった行はその場で差し替える
+                layout.removeWidget(new)
+                layout.replaceWidget(w, new)
+                w.setParent(None)
+            self.entries[key] = new
+        for cat, box in list(self.groups.items()):
+            if box.layout().count() == 0:
+                box.setParent(None)
+                del self.groups[cat]
+
+    def clear_entries(self):
+        for w in self.entries.values():
+            w.setParent(None)
+        for box in self.groups.values():
+            box.setParent(None)
+        self.entries.clear()
+        self.groups.clear()
 
+    @traced('catalog.add_entry')
     def add_entry(self, layout, app):
         title = app['title']
         desc  = app['description']
@@ -215,22 +773,25 @@ class AppDownloader(QMainWindow):
         folder= app.get('folder', title)
         exe   = app.get('exe', f"{title}.exe")
         w = QWidget()
+        w.app = app
+        w.buttons = None
         hl= QHBoxLayout(w)
         lbl= QLabel(f"<b>{title}</b><br>{desc}<br><i>対応OS: {osn}</i>")
         hl.addWidget(lbl)
         if kind=='app':
-            exists = os.path.isdir(folder)
-            dl = QPushButton("Download")
-            dl.setEnabled(not exists)
-            dl.clicked.connect(lambda _, u=url, f=folder: DownloadWindow(u, f, parent=self))
+            exists = self.registry.is_installed(folder)
+            update = exists and self.has_update(app)
+            dl = QPushButton(download_label(update, self.has_partial(app)))
+            dl.setEnabled(update or not exists)
+            dl.clicked.connect(lambda _, a=app: self.on_entry_action(a, 'download'))
             hl.addWidget(dl)
             run = QPushButton("実行")
             run.setEnabled(exists)
-            run.clicked.connect(lambda _, f=folder, e=exe: subprocess.Popen([os.path.join(f,e)], shell=e.lower().endswith('.bat')))
+            run.clicked.connect(lambda _, f=folder, e=exe: self.run_app(f, e))
             hl.addWidget(run)
             rd = QPushButton("ReadMe")
             rd.setEnabled(exists)
-            rd.clicked.connect(lambda _, f=folder: subprocess.Popen(['notepad', os.path.join(f,'README.txt')]))
+            rd.clicked.connect(lambda _, f=folder: self.open_readme(f))
             hl.addWidget(rd)
             dlt= QPushButton("削除")
             dlt.setEnabled(exists)
@@ -240,74 +801,200 @@ class AppDownloader(QMainWindow):
                 gh= QPushButton("GitHub")
                 gh.clicked.connect(lambda _, u=app['repo']: QDesktopServices.openUrl(QUrl(u)))
                 hl.addWidget(gh)
+            w.folder = folder
+            w.buttons = (dl, run, rd, dlt)
         else:
             btn= QPushButton("開く")
             btn.clicked.connect(lambda _, u=url: QDesktopServices.openUrl(QUrl(u)))
             hl.addWidget(btn)
         layout.addWidget(w)
+        return w
+
+    def refresh_entry(self, w):
+        if w.buttons is None:
+            return
+        dl, run, rd, dlt = w.buttons
+        exists = self.registry.is_installed(w.folder)
+        update = exists and self.has_update(w.app)
+        dl.setText(download_label(update, self.has_partial(w.app)))
+        dl.setEnabled(update or not exists)
+        for btn in (run, rd, dlt):
+            btn.setEnabled(exists)
+
+    def on_entry_action(self, app, name):
+        title = app['title']
+        folder = app_folder(app)
+        if name == 'download':
+            manifest = app.get('manifest') if self.registry.is_installed(folder) else None
+            self.downloads.submit(app['link'], folder, title=title, version=app.get('version'),
+                                  sha256=app.get('sha256'), size=app.get('size'), manifest=manifest)
+        elif name == 'run':
+            self.run_app(folder, app.get('exe', f"{title}.exe"))
+        elif name == 'readme':
+            self.open_readme(folder)
+        elif name == 'delete':
+            self.confirm_delete(folder)
+        elif name == 'github':
+            QDesktopServices.openUrl(QUrl(app['repo']))
+        elif name == 'open':
+            QDesktopServices.openUrl(QUrl(app['link']))
+
+    def run_app(self, folder, exe):
+        subprocess.Popen([os.path.join(folder, exe)], shell=exe.lower().endswith('.bat'))
+
+    def open_readme(self, folder):
+        subprocess.Popen(['notepad', os.path.join(folder, 'README.txt')])
 
     def confirm_delete(self, folder):
         res = QMessageBox.question(self, "削除確認", f"'{folder}'を削除しますか？", QMessageBox.Yes | QMessageBox.No)
-        if res == QMessageBox.Yes:
-            shutil.rmtree(folder)
-            self.reload_apps()
+        if res == QMessageBox.Yes and not self.file_ops.busy(folder):
+            # 削除はバックグラウンドで行い、一覧からはすぐに外す
+            self.registry.remove(folder)
+            self.file_ops.delete(folder)
+            self.refresh_installed()
 
+    def on_file_op(self, op, path, error):
+        if error is None:
+            return
+        self.statusBar().showMessage(f"ファイル操作に失敗しました ({path}): {error}", 5000)
+        self.reconcile_installed()
+
+    # 索引から表示する行のキーを求め、行ごとに表示を切り替える
+    def filtering(self):
+        return (self.combo_os.currentIndex() > 0 or self.combo_cat.currentIndex() > 0
+                or self.combo_state.currentIndex() > 0 or bool(self.search.text().strip()))
+
+    @traced('catalog.filter_items')
     def filter_items(self, _):
         so = self.combo_os.currentText()
         sc = self.combo_cat.currentText()
-        for app in self.apps:
-            cat = app.get('category','')
-            osn = app.get('os','')
-            box = self.groups.get(cat)
-            if box:
-                box.setVisible((sc=='すべてのカテゴリ' or sc==cat) and (so=='すべてのOS' or so==osn))
+        st = self.combo_state.currentIndex()
+        keys = self.index.filter(os_name=None if so == 'すべてのOS' else so,
+                                 category=None if sc == 'すべてのカテゴリ' else sc,
+                                 installed=None if st == 0 else st == 1,
+                                 query=self.search.text())
+        if self.use_virtual():
+            self.proxy.set_visible(None if len(keys) == len(self.index.all) else keys)
+            return
+        shown = set()
+        for key, w in self.entries.items():
+            visible = key in keys
+            w.setVisible(visible)
+            if visible:
+                shown.add(w.app.get('category','未分類'))
+        for cat, box in self.groups.items():
+            box.setVisible(cat in shown)
 
+# サーバー確認とカタログ取得を並行して行い、カタログが表示できた時点で本体を出す
 class SplashManager(QObject):
     finished = pyqtSignal()
-    def __init__(self, splash):
+    def __init__(self, splash, win):
         super().__init__()
         self.splash = splash
-        self.steps = [
-            ("ネットワーク接続確認中", self.check_ping),
-            ("サーバーの確認中", self.check_ping),
-            ("情報を取得中", self.wait1),
-            ("ロード中", self.wait2)
-        ]
-        self.cur = 0
+        self.win = win
+        self.text = "ネットワーク接続確認中"
         self.dots= 0
-    def start(self): self.run_step()
-    def run_step(self):
-        if self.cur>=len(self.steps):
-            self.splash.showMessage(f"{APP_TITLE} {APP_VERSION}", Qt.AlignHCenter|Qt.AlignBottom, Qt.white)
-            QTimer.singleShot(500, self.finished.emit)
-            return
-        txt, fn = self.steps[self.cur]
+        self.server_ok = None
+        self.closed = False
+        self.manager = QNetworkAccessManager(self)
+        self.manager.finished.connect(self.on_server_reply)
+    def start(self):
         self.anim = QTimer(self)
-        self.anim.timeout.connect(lambda: self.update_dots(txt))
+        self.anim.timeout.connect(self.update_dots)
         self.anim.start(500)
-        fn()
-    def update_dots(self, base):
+        # 最初のページを表示できた時点で本体を出す（残りは表示後に届く）
+        self.win.catalog_shown.connect(self.done)
+        self.win.catalog_ready.connect(self.done)
+        QTimer.singleShot(SPLASH_TIMEOUT_MS, self.done)
+        self.check_server()
+    def update_dots(self):
         self.dots = (self.dots+1)%4
-        self.splash.showMessage(f"{base}{'.'*self.dots}", Qt.AlignHCenter|Qt.AlignBottom, Qt.white)
-    def check_ping(self):
-        host = HOMEPAGE_URL.replace('https://','').replace('http://','')
-        flag = '-n' if sys.platform.startswith('win') else '-c'
-        subprocess.Popen(['ping', flag, '5', host], stdout=subprocess.DEVNULL).wait()
-        QTimer.singleShot(300, self.done)
-    def wait1(self): QTimer.singleShot(1000, self.done)
-    def wait2(self): QTimer.singleShot(2000, self.done)
+        self.splash.showMessage(f"{self.text}{'.'*self.dots}", Qt.AlignHCenter|Qt.AlignBottom, Qt.white)
+    def check_server(self):
+        self.check_started = time.perf_counter()
+        req = QNetworkRequest(QUrl(HOMEPAGE_URL))
+        req.setTransferTimeout(SERVER_CHECK_TIMEOUT_MS)
+        self.manager.head(req)
+    def on_server_reply(self, reply):
+        self.server_ok = reply.error() == reply.NoError
+        reply.deleteLater()
+        trace_core.instant('splash.server_check', ok=self.server_ok,
+                           ms=round((time.perf_counter() - self.check_started) * 1000, 1))
+        self.text = "情報を取得中" if self.server_ok else "サーバーに接続できません"
+        if not self.server_ok and self.closed:
+            self.win.statusBar().showMessage("サーバーに接続できません", 10000)
     def done(self):
+        if self.closed:
+            return
+        self.closed = True
         self.anim.stop()
-        self.cur += 1
-        self.run_step()
+        self.splash.showMessage(f"{APP_TITLE} {APP_VERSION}", Qt.AlignHCenter|Qt.AlignBottom, Qt.white)
+        if self.server_ok is False:
+            self.win.statusBar().showMessage("サーバーに接続できません", 10000)
+        self.finished.emit()
+
+# 起動時間の計測（--startup-time 指定時のみ）。初回描画後に結果を書き出して終了する
+class StartupTimer:
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.marks = {}
+    def mark(self, name):
+        if self.enabled:
+            self.marks.setdefault(name, round((time.perf_counter() - _T0) * 1000, 1))
+    def report(self):
+        if not self.enabled:
+            return
+        data = {'unit': 'ms', 'frozen': getattr(sys, 'frozen', False), 'marks': self.marks}
+        text = json.dumps(data, ensure_ascii=False, indent=1)
+        with open(STARTUP_TIME_PATH, 'w', encoding='utf-8') as f:
+            f.write(text)
+        if sys.stderr:
+            print(text, file=sys.stderr)
+
+# requests と接続プールを用意し、ミラーの応答時間を測る（以降のダウンロードは速い順に使う）
+def warm_network():
+    net_core.session()
+    mirrors().probe()
+
+# 本体表示後に、重いモジュールを先に読み込んでおく
+def prewarm(win):
+    threading.Thread(target=warm_network, daemon=True).start()
+    if PREWARM_WEB_ENGINE or PRELOAD_WEB:
+        import PyQt5.QtWebEngineWidgets
+    if PRELOAD_WEB:
+        win.web.preload(PRELOAD_WEB_PAGES)
+
+def show_main(splash, win, timer):
+    # finish() は本体が表示されるまで最大1秒待つので、先に show() する
+    win.show()
+    splash.finish(win)
+    timer.mark('window_shown')
+    if timer.enabled:
+        # 表示イベントの処理後を初回描画とみなす
+        QTimer.singleShot(0, lambda: (timer.mark('first_paint'), timer.report(), QApplication.quit()))
+    else:
+        QTimer.singleShot(PREWARM_DELAY_MS, lambda: prewarm(win))
 
 if __name__=='__main__':
+    timer = StartupTimer(STARTUP_TIME_FLAG in sys.argv)
+    timer.mark('imports')
+    if trace_core.TRACE_FLAG in sys.argv:
+        # 終了時に ~/.hijikinoheya/trace.json へ書き出す
+        trace_core.enable()
+    # QtWebEngine を後から読み込めるようにする（QApplication 作成前に必要）
+    QApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
     app = QApplication(sys.argv)
+    timer.mark('qapplication')
     pix = QPixmap(LOGO_PATH) if os.path.exists(LOGO_PATH) else QPixmap(300,300)
     splash = QSplashScreen(pix.scaled(800,600, Qt.KeepAspectRatio), Qt.WindowStaysOnTopHint)
     splash.show()
-    mgr = SplashManager(splash)
     win = AppDownloader()
-    mgr.finished.connect(lambda: (splash.finish(win), win.show()))
+    timer.mark('main_window')
+    win.catalog_shown.connect(lambda: timer.mark('catalog_shown'))
+    win.catalog_ready.connect(lambda: timer.mark('catalog_ready'))
+    mgr = SplashManager(splash, win)
+    mgr.finished.connect(lambda: show_main(splash, win, timer))
     mgr.start()
+    if trace_core.TRACE_FLAG in sys.argv:
+        app.aboutToQuit.connect(lambda: (os.makedirs(DATA_DIR, exist_ok=True), trace_core.export(TRACE_PATH)))
     sys.exit(app.exec_())
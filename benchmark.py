@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.server
+import functools
+
+# ローカルの仮サーバーと合成データで、カタログ表示・ダウンロード・展開・起動時間を計測する
+# 結果は JSON で出力する（リリース間の比較用）
+#   python benchmark.py --apps 10,1000,10000 -o bench.json
+DEFAULT_APPS = "10,100,1000,10000"
+SMALL_FILES = 2000
+SMALL_FILE_SIZE = 4 * 1024
+LARGE_FILES = 2
+LARGE_FILE_MB = 32
+CATEGORIES = ["Tool", "Game", "Utility", "Media", "BetaAPP", "Office", "Dev", "Network"]
+OS_NAMES = ["Windows", "Mac", "全OS"]
+WORDS = ["画像", "変換", "editor", "viewer", "tool", "player", "メモ", "管理", "sync", "backup"]
+
+
+# Range と ETag に対応した静的ファイルサーバー
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        etag = '"%d-%d"' % (size, int(os.path.getmtime(path)))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        start, end = 0, size - 1
+        rng = self.headers.get('Range')
+        if rng and rng.startswith('bytes=') and size:
+            first, _, last = rng[6:].partition('-')
+            start = int(first or 0)
+            end = min(int(last), size - 1) if last else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(remaining, 1024 * 1024))
+                if not data:
+                    break
+                self.wfile.write(data)
+                remaining -= len(data)
+
+
+def serve(root):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(RangeHandler, directory=root))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def make_catalog(count, base_url, rng):
+    apps = []
+    for i in range(count):
+        words = rng.sample(WORDS, 3)
+        app = {
+            'title': f"App{i:05d} {words[0]}",
+            'description': f"{words[1]} と {words[2]} のためのアプリ {i}",
+            'link': base_url + "small.zip",
+            'os': OS_NAMES[i % len(OS_NAMES)],
+            'category': CATEGORIES[i % len(CATEGORIES)],
+            'version': "1.0",
+            'folder': f"App{i:05d}",
+        }
+        if i % 50 == 49:
+            app['type'] = 'link'
+        apps.append(app)
+    return apps
+
+
+# ラッパーフォルダ付きのZip（小さいファイルが多いもの / 大きいファイルが少ないもの）
+def make_zips(root, args):
+    small = os.path.join(root, "small.zip")
+    with zipfile.ZipFile(small, 'w', zipfile.ZIP_DEFLATED) as z:
+        for i in range(args.small_files):
+            data = (f"line {i} " * (SMALL_FILE_SIZE // 16)).encode()[:SMALL_FILE_SIZE // 2]
+            z.writestr(f"Bench/d{i % 40}/f{i}.txt", data + os.urandom(SMALL_FILE_SIZE // 2))
+    large = os.path.join(root, "large.zip")
+    with zipfile.ZipFile(large, 'w', zipfile.ZIP_DEFLATED) as z:
+        for i in range(LARGE_FILES):
+            block = os.urandom(1024 * 1024)
+            with z.open(f"Bench/bin/large{i}.bin", 'w', force_zip64=True) as f:
+                for _ in range(args.large_mb):
+                    f.write(block[:512 * 1024] + bytes(512 * 1024))
+    return {'small': small, 'large': large}
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return round((time.perf_counter() - start) * 1000, 2), result
+
+
+def best(times):
+    return min(times)
+
+
+# カタログ取得から一覧表示まで（AppDownloader を offscreen で作る）
+def bench_catalog(sizes, base_url, root, repeat):
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    import app_downloader
+    results = []
+    for count in sizes:
+        url = f"{base_url}app_{count}.json"
+        app_downloader.API_URL = url
+        row = {'apps': count, 'bytes': os.path.getsize(os.path.join(root, f"app_{count}.json"))}
+        firsts, loads, populates, filters, paints = [], [], [], [], []
+        for _ in range(repeat):
+            cache = os.path.join(os.environ['HOME'], ".hijikinoheya", "catalog.json")
+            if os.path.exists(cache):
+                os.remove(cache)
+            shown, ready = [], []
+            start = time.perf_counter()
+            win = app_downloader.AppDownloader()
+            win.catalog_shown.connect(lambda: shown.append(time.perf_counter()))
+            win.catalog_ready.connect(lambda: ready.append(time.perf_counter()))
+            while not ready and time.perf_counter() - start < 60:
+                app.processEvents()
+                time.sleep(0.001)
+            if not ready:
+                raise RuntimeError(f"カタログを読み込めませんでした: {url}")
+            firsts.append(round((shown[0] - start) * 1000, 2))
+            loads.append(round((ready[0] - start) * 1000, 2))
+            paints.append(timed(lambda: (win.show(), app.processEvents()))[0])
+            # 同じカタログの再表示（差分更新の経路）
+            populates.append(timed(lambda: (win.populate(), win.filter_items(None)))[0])
+            win.search.blockSignals(True)
+            win.search.setText("tool")
+            win.search.blockSignals(False)
+            filters.append(timed(lambda: win.filter_items(None))[0])
+            win.close()
+            win.downloads.close()
+            win.deleteLater()
+            app.processEvents()
+        row.update({'virtual': count >= app_downloader.VIRTUAL_THRESHOLD,
+                    'fetch_to_first_entry_ms': best(firsts), 'fetch_to_catalog_ready_ms': best(loads), 'show_and_paint_ms': best(paints),
+                    'repopulate_ms': best(populates), 'filter_ms': best(filters)})
+        results.append(row)
+    return results
+
+
+def bench_download(base_url, zips, work, repeat):
+    from download_core import SegmentedDownloader
+    from install_core import download_and_install
+    results = []
+    for name, path in zips.items():
+        size = os.path.getsize(path)
+        for connections in (1, 4):
+            times = []
+            for _ in range(repeat):
+                target = os.path.join(work, f"dl_{name}.zip")
+                ms, _ = timed(lambda: SegmentedDownloader(base_url + os.path.basename(path), target,
+                                                          connections=connections).run())
+                os.remove(target)
+                times.append(ms)
+            results.append({'zip': name, 'bytes': size, 'connections': connections, 'ms': best(times),
+                            'mb_per_s': round(size / 1048576 / (best(times) / 1000), 1)})
+        times = []
+        for _ in range(repeat):
+            folder = os.path.join(work, "Bench")
+            ms, _ = timed(lambda: download_and_install(base_url + os.path.basename(path), folder))
+            shutil.rmtree(folder)
+            times.append(ms)
+        results.append({'zip': name, 'bytes': size, 'streaming_install_ms': best(times),
+                        'mb_per_s': round(size / 1048576 / (best(times) / 1000), 1)})
+    return results
+
+
+# 以前の展開方法（extractall の後、ラッパーフォルダの中身を1つずつ移動する）
+def extract_legacy(zip_path, dest, strip):
+    with zipfile.ZipFile(zip_path) as z:
+        z.extractall(dest)
+    sub = os.path.join(dest, strip)
+    if os.path.isdir(sub):
+        for item in os.listdir(sub):
+            shutil.move(os.path.join(sub, item), dest)
+        shutil.rmtree(sub)
+
+
+def bench_extract(zips, work, repeat):
+    from install_core import extract_zip, EXTRACT_WORKERS
+    results = []
+    for name, path in zips.items():
+        with zipfile.ZipFile(path) as z:
+            infos = z.infolist()
+        # workers が None の行は以前の extractall + move
+        for workers in [None] + sorted({1, EXTRACT_WORKERS}):
+            times = []
+            for _ in range(repeat):
+                dest = os.path.join(work, "extract")
+                if workers is None:
+                    ms, _ = timed(lambda: extract_legacy(path, dest, "Bench"))
+                else:
+                    ms, _ = timed(lambda: extract_zip(path, dest, strip="Bench", workers=workers))
+                shutil.rmtree(dest)
+                times.append(ms)
+            results.append({'zip': name, 'files': len(infos), 'bytes': sum(i.file_size for i in infos),
+                            'method': 'extractall' if workers is None else 'extract_zip',
+                            'workers': workers, 'ms': best(times)})
+    return results
+
+
+# 別プロセスで --startup-time を実行し、初回描画までの時間を読む
+def bench_startup(base_url, work, repeat):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_downloader.py")
+    env = dict(os.environ, HIJIKINOHEYA_CATALOG_URL=base_url + "app_100.json")
+    runs = []
+    for _ in range(repeat):
+        subprocess.run([sys.executable, script, "--startup-time"], cwd=work, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
+        with open(os.path.join(work, "startup_time.json"), encoding='utf-8') as f:
+            runs.append(json.load(f)['marks'])
+    return {'runs': runs, 'first_paint_ms': min(r.get('first_paint', float('inf')) for r in runs)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark", description="App Downloader のベンチマーク")
+    parser.add_argument('--apps', default=DEFAULT_APPS, help="カタログの件数（カンマ区切り）")
+    parser.add_argument('--small-files', type=int, default=SMALL_FILES)
+    parser.add_argument('--large-mb', type=int, default=LARGE_FILE_MB, help="大きいファイル1つのサイズ (MB)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip', default="", help="省略する計測 (catalog,download,extract,startup)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', help="結果の出力先（省略時は標準出力）")
+    args = parser.parse_args(argv)
+    sizes = [int(n) for n in args.apps.split(',') if n]
+    # 作業中は一時フォルダへ移動するので、出力先は先に絶対パスにしておく
+    output = os.path.abspath(args.output) if args.output else None
+    skip = set(args.skip.split(','))
+
+    root = tempfile.mkdtemp(prefix="hijikinoheya-bench-")
+    # 利用者のカタログやキャッシュに触れないよう、HOME を一時フォルダへ向ける
+    home = os.path.join(root, "home")
+    os.makedirs(home)
+    os.environ['HOME'] = os.environ['USERPROFILE'] = home
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    www = os.path.join(root, "www")
+    work = os.path.join(root, "work")
+    os.makedirs(www)
+    os.makedirs(work)
+    server, base_url = serve(www)
+    rng = random.Random(args.seed)
+    try:
+        for count in sorted(set(sizes) | {100}):
+            with open(os.path.join(www, f"app_{count}.json"), 'w', encoding='utf-8') as f:
+                json.dump(make_catalog(count, base_url, rng), f, ensure_ascii=False)
+        zips = make_zips(www, args)
+        report = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+        }
+        os.chdir(work)
+        if 'catalog' not in skip:
+            report['catalog'] = bench_catalog(sizes, base_url, www, args.repeat)
+        if 'download' not in skip:
+            report['download'] = bench_download(base_url, zips, work, args.repeat)
+        if 'extract' not in skip:
+            report['extract'] = bench_extract(zips, work, args.repeat)
+        if 'startup' not in skip:
+            report['startup'] = bench_startup(base_url, work, args.repeat)
+    finally:
+        server.shutdown()
+        os.chdir(os.path.dirname(root))
+        shutil.rmtree(root, ignore_errors=True)
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+import os
+import json
+import bisect
+import codecs
+import re
+from urllib.parse import urljoin
+
+# 検証用のサーバーなどに向ける場合は環境変数で指定する
+CATALOG_URL = os.environ.get("HIJIKINOHEYA_CATALOG_URL") or "https://home.hijikinoheya.com/app/app.json"
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".hijikinoheya")
+CATALOG_CACHE = os.path.join(DATA_DIR, "catalog.json")
+SCAN_LIMIT = 256
+MATCH_CACHE_SIZE = 64
+# 読み込みながら一覧へ渡す単位（件数）と、一度に読むバイト数
+PAGE_SIZE = 200
+READ_CHUNK = 64 * 1024
+MAX_PAGES = 1000
+
+
+# app.json を少しずつ読み、アプリが揃うたびに返す。対応する形式:
+#   [{...}, {...}]                            従来の配列
+#   {...}\n{...}\n                            NDJSON（1行1アプリ）
+#   {"apps": [{...}], "next": "app-2.json"}   ページ分割（next に続きのURL）
+class CatalogParser:
+    def __init__(self):
+        self.mode = None
+        self.next = None
+        self.done = False
+        self.count = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._wait = 0
+
+    def feed(self, data, final=False):
+        self._buf += self._decoder.decode(data, final)
+        # 途中までのアプリを何度も解析し直さないよう、残りが倍になるまで待つ
+        if not final and len(self._buf) < self._wait:
+            return []
+        buf = self._buf
+        n = len(buf)
+        pos = 0
+        apps = []
+        while not self.done:
+            while pos < n and (buf[pos] in ' \t\r\n' or (buf[pos] == ',' and self.mode == 'array')):
+                pos += 1
+            if pos >= n:
+                break
+            if self.mode is None:
+                self.mode = 'array' if buf[pos] == '[' else 'lines'
+                if self.mode == 'array':
+                    pos += 1
+                    continue
+            if self.mode == 'array' and buf[pos] == ']':
+                self.done = True
+                pos += 1
+                break
+            try:
+                value, end = self._json.raw_decode(buf, pos)
+            except ValueError:
+                if final:
+                    raise
+                break
+            if not isinstance(value, dict):
+                raise ValueError("カタログの形式が不正です")
+            pos = end
+            if self.mode == 'lines' and self.count == 0 and isinstance(value.get('apps'), list):
+                self.mode = 'page'
+                self.next = value.get('next')
+                self.done = True
+                apps.extend(value['apps'])
+                break
+            apps.append(value)
+            self.count += 1
+        self._buf = buf[pos:] if not self.done else ""
+        self._wait = len(self._buf) * 2
+        return apps
+
+    def close(self):
+        apps = self.feed(b'', final=True)
+        if self.mode is None or (self.mode == 'array' and not self.done):
+            raise ValueError("カタログが途中で終わっています")
+        return apps
+
+
+# バイト列の並びを解析し、PAGE_SIZE 件ずつのリストにして返す
+def catalog_pages(chunks, parser=None, page_size=PAGE_SIZE):
+    parser = parser or CatalogParser()
+    for data in chunks:
+        apps = parser.feed(data)
+        for i in range(0, len(apps), page_size):
+            yield apps[i:i + page_size]
+    apps = parser.close()
+    for i in range(0, len(apps), page_size):
+        yield apps[i:i + page_size]
+
+
+def _chunks(body):
+    view = memoryview(body)
+    for i in range(0, len(body), READ_CHUNK):
+        yield bytes(view[i:i + READ_CHUNK])
+
+
+# app.json をそのまま保存し、ETag / Last-Modified で再検証できるようにする
+class CatalogCache:
+    def __init__(self, path=CATALOG_CACHE, url=None):
+        self.path = path
+        self.meta_path = path + ".meta"
+        self.url = url
+        self.body = None
+        self.meta = {}
+
+    def load(self):
+        apps = []
+        for page in self.load_pages():
+            apps.extend(page)
+        return apps if self.body is not None else None
+
+    # 保存済みのカタログを少しずつ解析して返す。壊れていた場合は途中で終わり、body は None のまま
+    def load_pages(self, page_size=PAGE_SIZE):
+        try:
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(self.path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return
+        if self.url and meta.get('url') != self.url:
+            return
+        try:
+            yield from catalog_pages(_chunks(body), page_size=page_size)
+        except ValueError:
+            return
+        self.body = body
+        self.meta = meta
+
+    def validators(self):
+        if self.body is None:
+            return {}
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+    def unchanged(self, body):
+        return self.body is not None and body == self.body
+
+    def save(self, body, etag=None, last_modified=None):
+        self.body = body
+        self.meta = {'url': self.url, 'etag': etag, 'last_modified': last_modified}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        for path, data in ((self.path, body),
+                           (self.meta_path, json.dumps(self.meta).encode('utf-8'))):
+            tmp = path + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+
+# カタログを受信しながら PAGE_SIZE 件ずつ返す（ページ分割の形式なら next を順にたどる）
+# 最後まで読めたら cache に保存する。保存済みのものと同じなら changed は False
+class CatalogStream:
+    def __init__(self, url=CATALOG_URL, cache=None, page_size=PAGE_SIZE):
+        self.url = url
+        self.cache = cache
+        self.page_size = page_size
+        self.apps = []
+        self.changed = True
+
+    def pages(self):
+        # mirror_core がこのモジュールを読み込むため、ここで読み込む
+        from mirror_core import get_mirrored
+        cache = self.cache
+        url = self.url
+        headers = cache.validators() if cache else {}
+        bodies = []
+        seen = set()
+        paged = False
+        while url and url not in seen and len(seen) < MAX_PAGES:
+            seen.add(url)
+            resp = get_mirrored(url, headers=headers, stream=True)
+            with resp:
+                if resp.status_code == 304 and not paged:
+                    self.changed = False
+                    return
+                resp.raise_for_status()
+                if not paged:
+                    etag = resp.headers.get('etag')
+                    last_modified = resp.headers.get('last-modified')
+                parser = CatalogParser()
+                for page in catalog_pages(self._record(resp, bodies), parser, self.page_size):
+                    self.apps.extend(page)
+                    yield page
+            if parser.mode != 'page' or not parser.next:
+                break
+            # 続きのページは条件付きにせず、まとめて1つの配列として保存する
+            paged = True
+            url = urljoin(url, parser.next)
+            headers = {}
+        if cache is None:
+            return
+        if paged:
+            body = json.dumps(self.apps, ensure_ascii=False).encode('utf-8')
+            etag = last_modified = None
+        else:
+            body = b''.join(bodies)
+        self.changed = not cache.unchanged(body)
+        try:
+            cache.save(body, etag=etag, last_modified=last_modified)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _record(resp, bodies):
+        for data in resp.iter_content(READ_CHUNK):
+            bodies.append(data)
+            yield data
+
+
+# GUIを使わずにカタログを取得する（保存済みのものがあれば条件付きで再検証）
+# offline=True なら保存済みのカタログだけを返す
+def fetch_catalog(url=CATALOG_URL, cache=None, offline=False):
+    cache = cache or CatalogCache(url=url)
+    cached = cache.load()
+    if offline:
+        return cached
+    stream = CatalogStream(url, cache)
+    try:
+        for _ in stream.pages():
+            pass
+    except (OSError, ValueError):
+        # 通信の失敗だけでなく、途中で切れた・壊れた応答でも保存済みのものを使う
+        if cached is not None:
+            return cached
+        raise
+    if not stream.changed and cached is not None:
+        return cached
+    return stream.apps
+
+
+def app_folder(app):
+    return app.get('folder', app['title'])
+
+
+# 一覧の行を識別するキー（同じキーが重複する場合は連番を付ける）
+def app_key(app):
+    return (app.get('id') or app.get('title', ''), app.get('os', '全OS'))
+
+
+def keyed_apps(apps):
+    keyed = {}
+    for app in apps:
+        key = app_key(app)
+        n = 1
+        while key in keyed:
+            n += 1
+            key = app_key(app) + (n,)
+        keyed[key] = app
+    return keyed
+
+
+# OS・カテゴリ・種類・インストール状態と、タイトル/説明の語による検索用の索引
+class CatalogIndex:
+    def __init__(self, apps=(), installed=None):
+        self.apps = {}
+        self.all = set()
+        self.by_os = {}
+        self.by_category = {}
+        self.by_type = {}
+        self.installed = set()
+        self._postings = {}
+        self._bigrams = {}
+        self._text = {}
+        self._key_words = {}
+        self._cache = {}
+        self._words = []
+        self._installed = installed
+        self.add(apps)
+
+    # 読み込み中のページを追加し、追加した行のキーを返す（キーの付け方は keyed_apps と同じ）
+    def add(self, apps):
+        keys = []
+        for app in apps:
+            key = base = app_key(app)
+            n = 1
+            while key in self.apps:
+                n += 1
+                key = base + (n,)
+            self.apps[key] = app
+            self.all.add(key)
+            keys.append(key)
+            self.by_os.setdefault(app.get('os', '全OS'), set()).add(key)
+            self.by_category.setdefault(app.get('category', '未分類'), set()).add(key)
+            self.by_type.setdefault(app.get('type', 'app'), set()).add(key)
+            text = f"{app.get('title', '')} {app.get('description', '')}".lower()
+            self._text[key] = text
+            self._key_words[key] = words = set(_WORD.findall(text))
+            for word in words:
+                self._postings.setdefault(word, set()).add(key)
+                if not word.isascii():
+                    for gram in set(word) | _ngrams(word):
+                        self._bigrams.setdefault(gram, set()).add(key)
+            if self._installed is not None and app.get('type', 'app') == 'app' and self._installed(app):
+                self.installed.add(key)
+        if keys:
+            self._words = None
+            self._cache.clear()
+        return keys
+
+    # installed(app) -> bool でインストール済みの集合を作り直す
+    def refresh_installed(self, installed):
+        self._installed = installed
+        self.installed = {k for k, app in self.apps.items()
+                          if app.get('type', 'app') == 'app' and installed(app)}
+
+    def search(self, query):
+        result = None
+        for term in _WORD.findall(query.lower()):
+            hits = self._match(term)
+            result = set(hits) if result is None else result & hits
+            if not result:
+                return set()
+        return set(self.all) if result is None else result
+
+    def filter(self, os_name=None, category=None, kind=None, installed=None, query=""):
+        sets = []
+        if os_name is not None:
+            sets.append(self.by_os.get(os_name, set()))
+        if category is not None:
+            sets.append(self.by_category.get(category, set()))
+        if kind is not None:
+            sets.append(self.by_type.get(kind, set()))
+        if installed is not None:
+            sets.append(self.installed if installed else self.by_type.get('app', set()) - self.installed)
+        terms = _WORD.findall(query.lower())
+        if not sets:
+            return self.search(query) if terms else set(self.all)
+        sets.sort(key=len)
+        result = set(sets[0]).intersection(*sets[1:])
+        if terms:
+            # 絞り込み後の件数が少なければ索引を引かずに直接照合する
+            if len(result) <= SCAN_LIMIT:
+                result = {k for k in result if all(self._contains(k, t) for t in terms)}
+            else:
+                result &= self.search(query)
+        return result
+
+    def _contains(self, key, term):
+        if not term.isascii() and term in self._text[key]:
+            return True
+        return any(w.startswith(term) for w in self._key_words[key])
+
+    def _match(self, term):
+        hits = self._cache.get(term)
+        if hits is None:
+            if len(self._cache) >= MATCH_CACHE_SIZE:
+                self._cache.clear()
+            hits = self._cache[term] = self._lookup(term)
+        return hits
+
+    def _lookup(self, term):
+        # 英数字は前方一致、日本語などは文字と2-gramで候補を絞って部分一致
+        hits = set()
+        if self._words is None:
+            self._words = sorted(self._postings)
+        i = bisect.bisect_left(self._words, term)
+        while i < len(self._words) and self._words[i].startswith(term):
+            hits |= self._postings[self._words[i]]
+            i += 1
+        if not term.isascii():
+            grams = _ngrams(term)
+            candidates = None
+            for gram in grams:
+                posting = self._bigrams.get(gram, set())
+                candidates = posting if candidates is None else candidates & posting
+            hits |= {k for k in candidates or () if term in self._text[k]}
+        return hits
+
+
+_WORD = re.compile(r'\w+')
+
+
+def _ngrams(word):
+    if len(word) < 2:
+        return {word}
+    return {word[i:i + 2] for i in range(len(word) - 1)}
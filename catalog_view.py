@@ -0,0 +1,173 @@
+import os
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSortFilterProxyModel, QRect, QSize, QEvent, pyqtSignal
+from PyQt5.QtWidgets import QApplication, QStyledItemDelegate, QStyle, QStyleOptionButton
+from PyQt5.QtGui import QFont
+from catalog_core import keyed_apps, app_folder
+
+APP_ROLE = Qt.UserRole
+INSTALLED_ROLE = Qt.UserRole + 1
+UPDATE_ROLE = Qt.UserRole + 2
+PARTIAL_ROLE = Qt.UserRole + 3
+ROW_HEIGHT = 72
+BUTTON_HEIGHT = 28
+BUTTON_SPACING = 6
+
+
+# partial は途中までダウンロード済みか（描画のたびにファイルを確認しないよう、呼び出し側で覚えておく）
+def download_label(update=False, partial=False):
+    if update:
+        return "更新"
+    return "再開" if partial else "Download"
+
+
+# 1行に表示するボタン: (名前, 表示文字列, 有効か)
+def entry_buttons(app, exists, update=False, partial=False):
+    if app.get('type', 'app') != 'app':
+        return [('open', "開く", True)]
+    update = exists and update
+    buttons = [
+        ('download', download_label(update, partial), update or not exists),
+        ('run', "実行", exists),
+        ('readme', "ReadMe", exists),
+        ('delete', "削除", exists),
+    ]
+    if app.get('category', '') == 'BetaAPP' and app.get('repo'):
+        buttons.append(('github', "GitHub", True))
+    return buttons
+
+
+# ウィジェットを作らずにカタログを保持するモデル（表示中の行だけ描画される）
+class CatalogModel(QAbstractListModel):
+    def __init__(self, parent=None, installed=None, updatable=None, resumable=None):
+        super().__init__(parent)
+        self.apps = []
+        self.keys = []
+        self.installed = installed or (lambda app: os.path.isdir(app_folder(app)))
+        self.updatable = updatable or (lambda app: False)
+        self.resumable = resumable or (lambda app: False)
+
+    def set_apps(self, apps):
+        # カテゴリ順にまとめ、同じ内容なら行の状態だけ更新する
+        order = {}
+        for app in apps:
+            order.setdefault(app.get('category', '未分類'), len(order))
+        items = sorted(keyed_apps(apps).items(), key=lambda kv: order[kv[1].get('category', '未分類')])
+        apps = [app for _, app in items]
+        if apps == self.apps:
+            self.refresh_state()
+            return
+        self.beginResetModel()
+        self.apps = apps
+        self.keys = [key for key, _ in items]
+        self.endResetModel()
+
+    # 読み込み中のページを末尾に足す（カテゴリ順への並べ替えは読み込み後の set_apps で行う）
+    def append_apps(self, apps, keys):
+        if not apps:
+            return
+        first = len(self.apps)
+        self.beginInsertRows(QModelIndex(), first, first + len(apps) - 1)
+        self.apps.extend(apps)
+        self.keys.extend(keys)
+        self.endInsertRows()
+
+    def refresh_state(self):
+        if self.apps:
+            self.dataChanged.emit(self.index(0), self.index(len(self.apps) - 1), [INSTALLED_ROLE, UPDATE_ROLE, PARTIAL_ROLE])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.apps)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        app = self.apps[index.row()]
+        if role == Qt.DisplayRole:
+            return app['title']
+        if role == APP_ROLE:
+            return app
+        if role == INSTALLED_ROLE:
+            return self.installed(app)
+        if role == UPDATE_ROLE:
+            return self.updatable(app)
+        if role == PARTIAL_ROLE:
+            return self.resumable(app)
+        return None
+
+
+# CatalogIndex で求めたキーの集合だけを表示する（None なら全件）
+class CatalogFilter(QSortFilterProxyModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.visible = None
+
+    def set_visible(self, keys):
+        self.visible = keys
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, row, parent):
+        return self.visible is None or self.sourceModel().keys[row] in self.visible
+
+
+# 行とボタンを直接描画し、クリック位置からボタンを判定する
+class CatalogDelegate(QStyledItemDelegate):
+    clicked = pyqtSignal(object, str)
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), ROW_HEIGHT)
+
+    def button_rects(self, option, index):
+        app = index.data(APP_ROLE)
+        buttons = entry_buttons(app, index.data(INSTALLED_ROLE), index.data(UPDATE_ROLE),
+                                index.data(PARTIAL_ROLE))
+        fm = option.fontMetrics
+        right = option.rect.right() - 8
+        top = option.rect.top() + (option.rect.height() - BUTTON_HEIGHT) // 2
+        rects = []
+        for name, text, enabled in reversed(buttons):
+            width = fm.horizontalAdvance(text) + 24
+            right -= width
+            rects.append((name, text, enabled, QRect(right, top, width, BUTTON_HEIGHT)))
+            right -= BUTTON_SPACING
+        rects.reverse()
+        return rects
+
+    def paint(self, painter, option, index):
+        app = index.data(APP_ROLE)
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        style.drawPrimitive(QStyle.PE_PanelItemViewItem, option, painter, widget)
+        buttons = self.button_rects(option, index)
+        left = option.rect.left() + 8
+        right = (buttons[0][3].left() if buttons else option.rect.right()) - 8
+        line = option.fontMetrics.height()
+        top = option.rect.top() + (option.rect.height() - line * 3) // 2
+        painter.save()
+        bold = QFont(option.font)
+        bold.setBold(True)
+        painter.setFont(bold)
+        painter.drawText(QRect(left, top, right - left, line), Qt.AlignLeft | Qt.AlignVCenter,
+                         f"{app['title']}  [{app.get('category', '未分類')}]")
+        painter.setFont(option.font)
+        desc = option.fontMetrics.elidedText(str(app.get('description', '')), Qt.ElideRight, right - left)
+        painter.drawText(QRect(left, top + line, right - left, line), Qt.AlignLeft | Qt.AlignVCenter, desc)
+        italic = QFont(option.font)
+        italic.setItalic(True)
+        painter.setFont(italic)
+        painter.drawText(QRect(left, top + line * 2, right - left, line), Qt.AlignLeft | Qt.AlignVCenter,
+                         f"対応OS: {app.get('os', '全OS')}")
+        painter.restore()
+        for name, text, enabled, rect in buttons:
+            opt = QStyleOptionButton()
+            opt.rect = rect
+            opt.text = text
+            opt.state = QStyle.State_Raised | (QStyle.State_Enabled if enabled else QStyle.State_None)
+            style.drawControl(QStyle.CE_PushButton, opt, painter, widget)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            for name, text, enabled, rect in self.button_rects(option, index):
+                if enabled and rect.contains(event.pos()):
+                    self.clicked.emit(index.data(APP_ROLE), name)
+                    return True
+        return False
@@ -0,0 +1,432 @@
+import os
+import json
+import math
+import threading
+import time
+import net_core
+import trace_core
+
+# ダウンロード設定
+CHUNK_SIZE = 64 * 1024
+CONNECTIONS = 4
+MIN_SEGMENT_SIZE = 2 * 1024 * 1024
+STATE_SAVE_INTERVAL = 1.0
+SPEED_WINDOW = 3.0
+TRACE_RATE_INTERVAL = 0.5
+
+
+class DownloadError(Exception):
+    pass
+
+
+class IntegrityError(DownloadError):
+    pass
+
+
+# トークンバケットによる帯域制限（rate はバイト/秒、0 なら無制限）
+class RateLimiter:
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._tokens = 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+            self._tokens = 0
+
+    def consume(self, n):
+        with self._lock:
+            if self.rate <= 0:
+                return
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+# 指数移動平均で平滑化した速度（バイト/秒）と残り時間を求める
+class SpeedMeter:
+    def __init__(self, window=SPEED_WINDOW):
+        self.window = window
+        self.speed = 0
+        self._last = None
+
+    def reset(self):
+        self.speed = 0
+        self._last = None
+
+    def sample(self, done, now=None):
+        now = time.monotonic() if now is None else now
+        if self._last is None:
+            self._last = (now, done)
+            return self.speed
+        t0, d0 = self._last
+        dt = now - t0
+        if dt <= 0:
+            return self.speed
+        rate = (done - d0) / dt
+        alpha = 1 - math.exp(-dt / self.window)
+        self.speed += alpha * (rate - self.speed)
+        self._last = (now, done)
+        return self.speed
+
+    def eta(self, done, total):
+        if not total or self.speed <= 0:
+            return None
+        return max(0, total - done) / self.speed
+
+
+# キャンセルと帯域制限をダウンロード全体（フォールバック時の再取得も含む）で共有する
+class DownloadControl:
+    def __init__(self, limiters=()):
+        self.canceled = threading.Event()
+        self.limiters = list(limiters)
+
+    def cancel(self):
+        self.canceled.set()
+
+    def throttle(self, n):
+        for limiter in self.limiters:
+            limiter.consume(n)
+
+
+def partial_path(path):
+    return path + ".part"
+
+
+def state_path(path):
+    return path + ".part.json"
+
+
+def discard_partial(path):
+    for p in (partial_path(path), state_path(path)):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+# HTTP Range で複数接続から並列取得する（Range非対応なら1本で取得）
+# 途中経過は <path>.part と <path>.part.json に保存し、次回は続きから再開する
+# on_progress(downloaded, total) はワーカースレッドから呼ばれる
+# mirrors（mirror_core.MirrorSet）を渡すと速いミラーから取得し、失敗したら別のミラーで続きを取る
+class SegmentedDownloader:
+    def __init__(self, url, path, connections=CONNECTIONS, on_progress=None, control=None, mirrors=None):
+        self.source = url
+        self.url = url
+        self.mirrors = mirrors
+        self.path = path
+        self.part = partial_path(path)
+        self.state_file = state_path(path)
+        self.connections = max(1, connections)
+        self.on_progress = on_progress
+        self.control = control or DownloadControl()
+        self.total = 0
+        self.downloaded = 0
+        self.resumed = 0
+        self.etag = None
+        self.last_modified = None
+        self.segments = []
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._error = None
+        self._saved_at = 0
+        self._traced_at = (0, 0)
+        self._progressed = threading.Condition(self._lock)
+        self._switch_lock = threading.Lock()
+        self._tried = set()
+
+    def cancel(self):
+        self.control.cancel()
+
+    def _stopped(self):
+        return self._cancel.is_set() or self.control.canceled.is_set()
+
+    # sink を渡すと、先頭から連続して届いたバイトを順に sink(data) へ流す
+    # Range対応時は .part を追いかけて読み、完了後は .part を残さない
+    # keep=True ならsinkを使う場合も完成したファイルを path に残す
+    @trace_core.traced('download.run')
+    def run(self, sink=None, keep=False):
+        started = time.monotonic()
+        resp = self._open_first()
+        if resp.status_code == 206:
+            self.total = _content_range_total(resp.headers.get('content-range', ''))
+            self.etag = resp.headers.get('etag')
+            self.last_modified = resp.headers.get('last-modified')
+            resp.close()
+            if self.total:
+                sink_error = self._run_segmented(sink)
+                self._record_speed(started)
+                if sink and sink_error is None and not keep:
+                    discard_partial(self.path)
+                    return None
+                os.replace(self.part, self.path)
+                discard_partial(self.path)
+                if sink_error is not None:
+                    raise sink_error
+                return self.path
+            resp = net_core.raise_for_status(net_core.get(self.url, stream=True, compress=False))
+        # Range非対応のサーバーは再開できないため途中状態を残さない
+        discard_partial(self.path)
+        self.total = int(resp.headers.get('content-length', 0))
+        if sink and not keep:
+            self._run_single(resp, sink)
+            self._record_speed(started)
+            return None
+        with open(self.path, 'wb') as f:
+            if sink:
+                self._run_single(resp, lambda data: (f.write(data), sink(data)))
+            else:
+                self._run_single(resp, f.write)
+        self._record_speed(started)
+        return self.path
+
+    # 速い順にミラーへ 1 バイトだけ要求し、最初に応答したものを使う
+    def _open_first(self):
+        candidates = self.mirrors.candidates(self.source) if self.mirrors else [self.url]
+        error = None
+        for url in candidates:
+            self._tried.add(url)
+            try:
+                resp = net_core.raise_for_status(
+                    net_core.get(url, headers={'Range': 'bytes=0-0'}, stream=True, compress=False))
+            except Exception as e:
+                if self.mirrors:
+                    self.mirrors.mark_failed(url)
+                error = e
+                continue
+            self.url = url
+            return resp
+        raise error
+
+    def _probe(self, url):
+        try:
+            resp = net_core.get(url, headers={'Range': 'bytes=0-0'}, stream=True, compress=False)
+            resp.close()
+        except Exception:
+            return None
+        if resp.status_code != 206:
+            return None
+        return (_content_range_total(resp.headers.get('content-range', '')),
+                resp.headers.get('etag'), resp.headers.get('last-modified'))
+
+    # failed が使えなくなったので、同じサイズのファイルを返す別のミラーへ切り替える
+    def _failover(self, failed):
+        if not self.mirrors:
+            return False
+        with self._switch_lock:
+            if self.url != failed:
+                # 他の接続がすでに切り替えた
+                return True
+            self.mirrors.mark_failed(failed)
+            for url in self.mirrors.candidates(self.source):
+                if url in self._tried or self._stopped():
+                    continue
+                self._tried.add(url)
+                info = self._probe(url)
+                if info and info[0] == self.total:
+                    with self._lock:
+                        self.url = url
+                        self.etag, self.last_modified = info[1], info[2]
+                    return True
+            return False
+
+    def _record_speed(self, started):
+        elapsed = time.monotonic() - started
+        if self.mirrors and elapsed > 0:
+            self.mirrors.record_speed(self.url, (self.downloaded - self.resumed) / elapsed)
+
+    def _run_single(self, resp, write):
+        with resp:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                if self._stopped():
+                    raise DownloadError("キャンセルされました")
+                if not chunk:
+                    continue
+                self.control.throttle(len(chunk))
+                write(chunk)
+                self._add(len(chunk))
+
+    def _run_segmented(self, sink=None):
+        if not self._load_state():
+            # 最終サイズで事前確保し、各接続が自分の範囲へ直接書き込む
+            with open(self.part, 'wb') as f:
+                f.truncate(self.total)
+            parts = self.connections if self.total >= MIN_SEGMENT_SIZE else 1
+            self.segments = [[s, e, s] for s, e in split_ranges(self.total, parts)]
+            self._save_state(force=True)
+        self.downloaded = self.resumed = sum(seg[2] - seg[0] for seg in self.segments)
+        threads = []
+        for seg in self.segments:
+            if seg[2] > seg[1]:
+                continue
+            t = threading.Thread(target=self._fetch_range, args=(seg,), daemon=True)
+            t.start()
+            threads.append(t)
+        sink_error = None
+        if sink:
+            try:
+                self._follow(sink)
+            except Exception as e:
+                # 展開側の失敗ではダウンロードを止めず、ファイルとして完成させる
+                sink_error = e
+        for t in threads:
+            t.join()
+        self._save_state(force=True)
+        if self._error:
+            raise self._error
+        if self._stopped():
+            raise DownloadError("キャンセルされました")
+        return sink_error
+
+    def _contiguous(self):
+        for seg in self.segments:
+            if seg[2] <= seg[1]:
+                return seg[2]
+        return self.total
+
+    def _follow(self, sink):
+        pos = 0
+        with open(self.part, 'rb') as f:
+            while pos < self.total:
+                with self._progressed:
+                    while self._contiguous() <= pos and not self._stopped():
+                        self._progressed.wait(0.5)
+                    available = self._contiguous()
+                if self._stopped():
+                    return
+                f.seek(pos)
+                while pos < available:
+                    data = f.read(min(CHUNK_SIZE, available - pos))
+                    sink(data)
+                    pos += len(data)
+
+    @trace_core.traced('download.segment')
+    def _fetch_range(self, seg):
+        attempt = 0
+        try:
+            while True:
+                pos = seg[2]
+                url = self.url
+                try:
+                    self._fetch_once(seg)
+                    return
+                except Exception as e:
+                    if self._stopped():
+                        raise
+                    # 受信できた分は残し、続きから取り直す
+                    attempt = 0 if seg[2] > pos else attempt + 1
+                    if net_core.transient(e) and attempt <= net_core.RETRIES:
+                        net_core.backoff(attempt)
+                    elif (isinstance(e, DownloadError) or net_core.network_error(e)) and self._failover(url):
+                        attempt = 0
+                    else:
+                        raise
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+            self._cancel.set()
+
+    def _fetch_once(self, seg):
+        start, end = seg[2], seg[1]
+        headers = {'Range': f'bytes={start}-{end}'}
+        with self._lock:
+            url = self.url
+            validator = self.etag or self.last_modified
+        if validator:
+            headers['If-Range'] = validator
+        resp = net_core.get(url, headers=headers, stream=True, compress=False)
+        # 拒否された場合も接続をプールへ返すため、先に with で囲む
+        with resp:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise DownloadError(f"Range要求が拒否されました: {resp.status_code}")
+            with open(self.part, 'r+b') as f:
+                f.seek(start)
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    if self._stopped():
+                        return
+                    if not chunk:
+                        continue
+                    self.control.throttle(len(chunk))
+                    f.write(chunk)
+                    f.flush()
+                    seg[2] += len(chunk)
+                    self._add(len(chunk))
+        if seg[2] != end + 1:
+            raise DownloadError(f"範囲 {start}-{end} の受信が途中で終了しました")
+
+    def _add(self, n):
+        with self._lock:
+            self.downloaded += n
+            done = self.downloaded
+            self._progressed.notify_all()
+            if trace_core.enabled:
+                self._trace_rate(done)
+        if self.segments:
+            self._save_state()
+        if self.on_progress:
+            self.on_progress(done, self.total)
+
+    # 受信速度を一定間隔でカウンターとして記録する
+    def _trace_rate(self, done):
+        now = time.monotonic()
+        at, before = self._traced_at
+        if now - at >= TRACE_RATE_INTERVAL:
+            if at:
+                trace_core.counter('download', bytes_per_s=int((done - before) / (now - at)))
+            self._traced_at = (now, done)
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        # ETag などはミラーごとに違うので、同じミラーから再開する場合だけ比べる
+        same_mirror = state.get('mirror', state.get('url')) == self.url
+        same = (state.get('url') == self.source
+                and state.get('total') == self.total
+                and (not same_mirror or (state.get('etag') == self.etag
+                                         and state.get('last_modified') == self.last_modified))
+                and os.path.exists(self.part)
+                and os.path.getsize(self.part) == self.total)
+        if not same:
+            # リモートのファイルが変わっている場合は最初から
+            discard_partial(self.path)
+            return False
+        self.segments = [list(seg) for seg in state.get('segments', [])]
+        return bool(self.segments)
+
+    def _save_state(self, force=False):
+        with self._lock:
+            now = time.time()
+            if not force and now - self._saved_at < STATE_SAVE_INTERVAL:
+                return
+            self._saved_at = now
+            state = {
+                'url': self.source,
+                'mirror': self.url,
+                'total': self.total,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+                'segments': [list(seg) for seg in self.segments],
+            }
+            tmp = self.state_file + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_file)
+
+
+def split_ranges(total, parts):
+    size = -(-total // parts)
+    return [(s, min(s + size, total) - 1) for s in range(0, total, size)]
+
+
+def _content_range_total(value):
+    # "bytes 0-0/12345"
+    total = value.rpartition('/')[2]
+    return int(total) if total.isdigit() else 0
@@ -0,0 +1,57 @@
+import os
+import shutil
+import threading
+import time
+from PyQt5.QtCore import QObject, pyqtSignal
+
+# 削除待ちのフォルダに付ける目印
+TRASH_MARK = ".deleting-"
+
+
+# 削除をGUIスレッドの外で行い、完了をシグナルで知らせる
+# finished(操作名, パス, 例外 または None) はGUIスレッドで受け取れる
+class FileOperations(QObject):
+    finished = pyqtSignal(str, str, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pending = set()
+        self._lock = threading.Lock()
+
+    # 先に同じフォルダ内の別名へ移して一覧からすぐ消し、中身は裏で削除する
+    def delete(self, path):
+        trash = f"{path}{TRASH_MARK}{int(time.time() * 1000)}"
+        try:
+            os.replace(path, trash)
+        except OSError:
+            # 使用中などで名前を変えられない場合はそのまま削除を試みる
+            trash = path
+        self._start('delete', path, lambda: shutil.rmtree(trash))
+
+    # 前回の終了時に削除しきれなかったフォルダを片付ける
+    def cleanup(self, root):
+        try:
+            names = [e.path for e in os.scandir(root) if e.is_dir() and TRASH_MARK in e.name]
+        except OSError:
+            return
+        for path in names:
+            self._start('cleanup', path, lambda p=path: shutil.rmtree(p, ignore_errors=True))
+
+    def busy(self, path):
+        with self._lock:
+            return path in self.pending
+
+    def _start(self, op, path, func):
+        with self._lock:
+            self.pending.add(path)
+        threading.Thread(target=self._run, args=(op, path, func), daemon=True).start()
+
+    def _run(self, op, path, func):
+        error = None
+        try:
+            func()
+        except Exception as e:
+            error = e
+        with self._lock:
+            self.pending.discard(path)
+        self.finished.emit(op, path, error)
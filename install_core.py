@@ -0,0 +1,679 @@
+import os
+import hashlib
+import heapq
+import itertools
+import shutil
+import struct
+import threading
+import time
+import zlib
+import zipfile
+import json
+import trace_core
+from concurrent.futures import ThreadPoolExecutor
+from download_core import SegmentedDownloader, DownloadControl, RateLimiter, IntegrityError, discard_partial
+from package_store import hash_file
+from path_core import safe_join
+from update_core import fetch_manifest, apply_update, discard_update, swap_folder
+from catalog_core import DATA_DIR
+from mirror_core import mirrors
+
+LOCAL_HEADER = b'PK\x03\x04'
+CENTRAL_HEADER = b'PK\x01\x02'
+END_OF_CENTRAL = b'PK\x05\x06'
+DATA_DESCRIPTOR = b'PK\x07\x08'
+LOCAL_HEADER_STRUCT = struct.Struct('<4sHHHHHIIIHH')
+ZIP64_LIMIT = 0xFFFFFFFF
+MAX_PARALLEL_INSTALLS = 3
+# zlib は展開中に GIL を解放するのでスレッドで並列に展開できる
+EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+EXTRACT_MIN_FILES_PER_WORKER = 16
+EXTRACT_FILE_COST = 64 * 1024
+REGISTRY_PATH = os.path.join(DATA_DIR, "installed.json")
+
+# インストールジョブの状態
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED = 'failed'
+CANCELED = 'canceled'
+
+
+class StreamUnsupported(Exception):
+    pass
+
+
+# Zipの先頭から順にローカルヘッダーを読み、届いたバイトをそのまま展開する
+# ラッパーフォルダ(strip)は取り除いて dest 直下へ書き込む
+class StreamingUnzipper:
+    def __init__(self, dest, strip=None):
+        self.dest = dest
+        self.strip = strip.rstrip('/') + '/' if strip else None
+        self.files = []
+        self._buf = bytearray()
+        self._state = 'header'
+        self._entry = None
+
+    def feed(self, data):
+        self._buf += data
+        while self._step():
+            pass
+
+    def abort(self):
+        if self._entry and self._entry['out'] is not None:
+            self._entry['out'].close()
+        self._entry = None
+
+    def close(self):
+        if self._state != 'done':
+            raise StreamUnsupported("Zipの終端に到達しませんでした")
+        return self.files
+
+    def _step(self):
+        if self._state == 'header':
+            return self._read_header()
+        if self._state == 'data':
+            return self._read_data()
+        if self._state == 'descriptor':
+            return self._read_descriptor()
+        # セントラルディレクトリ以降は不要
+        self._buf.clear()
+        return False
+
+    def _read_header(self):
+        if len(self._buf) < 4:
+            return False
+        sig = bytes(self._buf[:4])
+        if sig in (CENTRAL_HEADER, END_OF_CENTRAL):
+            self._state = 'done'
+            return True
+        if sig != LOCAL_HEADER:
+            raise StreamUnsupported("Zipのローカルヘッダーではありません")
+        if len(self._buf) < LOCAL_HEADER_STRUCT.size:
+            return False
+        (_, _, flags, method, mtime, mdate, crc, csize, usize,
+         name_len, extra_len) = LOCAL_HEADER_STRUCT.unpack_from(self._buf)
+        end = LOCAL_HEADER_STRUCT.size + name_len + extra_len
+        if len(self._buf) < end:
+            return False
+        raw_name = bytes(self._buf[LOCAL_HEADER_STRUCT.size:LOCAL_HEADER_STRUCT.size + name_len])
+        extra = bytes(self._buf[LOCAL_HEADER_STRUCT.size + name_len:end])
+        del self._buf[:end]
+        if flags & 0x1:
+            raise StreamUnsupported("暗号化されたZipはストリーム展開できません")
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise StreamUnsupported(f"未対応の圧縮方式です: {method}")
+        if flags & 0x8 and method == zipfile.ZIP_STORED:
+            raise StreamUnsupported("サイズ不明の無圧縮エントリはストリーム展開できません")
+        zip64 = _has_zip64(extra)
+        if csize == ZIP64_LIMIT or usize == ZIP64_LIMIT:
+            usize, csize = _zip64_sizes(extra, usize, csize)
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+        self._entry = {
+            'flags': flags,
+            'method': method,
+            'crc': crc,
+            'remaining': None if flags & 0x8 else csize,
+            'zip64': zip64,
+            'mtime': _dos_time(mdate, mtime),
+            'running_crc': 0,
+            'out': None,
+            'path': None,
+            'inflater': zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None,
+        }
+        path = self._target(name)
+        if path is not None and not name.endswith('/'):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._entry['out'] = open(path, 'wb')
+            self._entry['path'] = path
+        elif path is not None:
+            os.makedirs(path, exist_ok=True)
+        self._state = 'data'
+        return True
+
+    def _read_data(self):
+        e = self._entry
+        if e['remaining'] is not None:
+            n = min(e['remaining'], len(self._buf))
+            if n == 0 and e['remaining']:
+                return False
+            chunk = bytes(self._buf[:n])
+            del self._buf[:n]
+            e['remaining'] -= n
+            self._write(chunk if e['inflater'] is None else e['inflater'].decompress(chunk))
+            if e['remaining']:
+                return False
+            if e['inflater'] is not None:
+                self._write(e['inflater'].flush())
+        else:
+            if not self._buf:
+                return False
+            chunk = bytes(self._buf)
+            self._buf.clear()
+            self._write(e['inflater'].decompress(chunk))
+            if not e['inflater'].eof:
+                return False
+            self._buf[:0] = e['inflater'].unused_data
+        if e['flags'] & 0x8:
+            self._state = 'descriptor'
+            return True
+        return self._finish_entry(e['crc'])
+
+    def _read_descriptor(self):
+        size_len = 8 if self._entry['zip64'] else 4
+        if len(self._buf) < 4:
+            return False
+        offset = 4 if bytes(self._buf[:4]) == DATA_DESCRIPTOR else 0
+        need = offset + 4 + size_len * 2
+        if len(self._buf) < need:
+            return False
+        crc = struct.unpack_from('<I', self._buf, offset)[0]
+        del self._buf[:need]
+        return self._finish_entry(crc)
+
+    def _finish_entry(self, crc):
+        e = self._entry
+        if e['out'] is not None:
+            e['out'].close()
+            if e['running_crc'] != crc:
+                raise zipfile.BadZipFile(f"CRCが一致しません: {e['path']}")
+            os.utime(e['path'], (e['mtime'], e['mtime']))
+            self.files.append(e['path'])
+        self._entry = None
+        self._state = 'header'
+        return True
+
+    def _write(self, data):
+        e = self._entry
+        if not data:
+            return
+        e['running_crc'] = zlib.crc32(data, e['running_crc'])
+        if e['out'] is not None:
+            e['out'].write(data)
+
+    def _target(self, name):
+        if self.strip and name.startswith(self.strip):
+            name = name[len(self.strip):]
+        return safe_join(self.dest, name)
+
+
+# セントラルディレクトリを使った通常の展開（ストリーム展開できないZip用）
+# メンバーをサイズで振り分け、スレッドごとに別のハンドルで並列に展開する
+@trace_core.traced('install.extract_zip')
+def extract_zip(zip_path, dest, strip=None, workers=None):
+    prefix = strip.rstrip('/') + '/' if strip else None
+    entries = []
+    dirs = set()
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        for info in z.infolist():
+            name = info.filename
+            if prefix and name.startswith(prefix):
+                name = name[len(prefix):]
+            path = safe_join(dest, name)
+            if path is None:
+                continue
+            if info.is_dir():
+                dirs.add(path)
+                continue
+            dirs.add(os.path.dirname(path))
+            entries.append((info, path))
+    for d in sorted(dirs):
+        os.makedirs(d, exist_ok=True)
+    workers = min(workers or EXTRACT_WORKERS, max(1, len(entries) // EXTRACT_MIN_FILES_PER_WORKER))
+    if workers <= 1:
+        _extract_members(zip_path, entries)
+    else:
+        # 大きいものから順に、合計サイズが最も小さいワーカーへ割り当てる
+        buckets = [[] for _ in range(workers)]
+        loads = [0] * workers
+        for entry in sorted(entries, key=lambda e: e[0].file_size, reverse=True):
+            i = loads.index(min(loads))
+            buckets[i].append(entry)
+            loads[i] += entry[0].file_size + EXTRACT_FILE_COST
+        with ThreadPoolExecutor(workers) as pool:
+            for future in [pool.submit(_extract_members, zip_path, b) for b in buckets if b]:
+                future.result()
+    return [path for _, path in entries]
+
+
+@trace_core.traced('install.extract_members')
+def _extract_members(zip_path, entries):
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        for info, path in entries:
+            with z.open(info) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            mode = (info.external_attr >> 16) & 0o777
+            if info.create_system == 3 and mode:
+                os.chmod(path, mode)
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(path, (mtime, mtime))
+
+
+# ダウンロードしながら展開し、完了したら作業フォルダを folder へ置き換える
+# sha256 / size があれば検証し、store があれば取得したZipを保存して次回は再利用する
+# 展開したファイルの一覧を返す（Zipでなかった場合は None）
+@trace_core.traced('install.download_and_install')
+def download_and_install(url, folder, on_progress=None, on_status=None, control=None,
+                         sha256=None, size=None, store=None):
+    zip_path = folder + ".zip"
+    work = folder + ".installing"
+    strip = os.path.basename(os.path.normpath(folder))
+    if os.path.isdir(work):
+        shutil.rmtree(work)
+    cached = store.get(sha256) if store is not None and sha256 else None
+    if cached:
+        # 共有の置き場は途中で切れたり差し替えられたりしうるので、展開前に検証する
+        try:
+            _verify(hash_file(cached), os.path.getsize(cached), sha256, size)
+        except (IntegrityError, OSError):
+            trace_core.instant('install.cache_invalid', path=cached)
+            store.discard(sha256)
+            cached = None
+    if cached:
+        _status(on_status, "キャッシュから展開中...")
+        files = extract_zip(cached, work, strip=strip)
+        if on_progress:
+            total = os.path.getsize(cached)
+            on_progress(total, total)
+        return _finish_install(work, folder, files)
+    keep = store is not None and bool(sha256)
+    unzipper = StreamingUnzipper(work, strip=strip)
+    hasher = hashlib.sha256() if sha256 else None
+    received = [0]
+
+    # 展開と同時にハッシュを計算する
+    def sink(data):
+        if hasher is not None:
+            hasher.update(data)
+        received[0] += len(data)
+        unzipper.feed(data)
+
+    downloader = SegmentedDownloader(url, zip_path, on_progress=on_progress, control=control,
+                                     mirrors=mirrors())
+    _status(on_status, "ダウンロード・展開中...")
+    try:
+        try:
+            with trace_core.span('install.stream', url=url):
+                downloader.run(sink=sink, keep=keep)
+                files = unzipper.close()
+            _verify(hasher.hexdigest() if hasher else None, received[0], sha256, size)
+        except (StreamUnsupported, zipfile.BadZipFile):
+            # ストリーム展開できない場合はZipを保存してから展開する
+            unzipper.abort()
+            if os.path.isdir(work):
+                shutil.rmtree(work)
+            trace_core.instant('install.stream_unsupported', url=url)
+            if not os.path.exists(zip_path):
+                _status(on_status, "ダウンロード中...")
+                downloader = SegmentedDownloader(url, zip_path, on_progress=on_progress,
+                                                 control=control, mirrors=mirrors())
+                downloader.run()
+            _verify(hash_file(zip_path) if sha256 else None, os.path.getsize(zip_path), sha256, size)
+            if not zipfile.is_zipfile(zip_path):
+                return None
+            _status(on_status, "Zipを解凍中...")
+            files = extract_zip(zip_path, work, strip=strip)
+    except IntegrityError:
+        unzipper.abort()
+        discard_install(folder)
+        raise
+    except BaseException:
+        unzipper.abort()
+        raise
+    if os.path.exists(zip_path):
+        if keep:
+            store.add(zip_path, sha256)
+        else:
+            os.remove(zip_path)
+    return _finish_install(work, folder, files)
+
+
+@trace_core.traced('install.finish')
+def _finish_install(work, folder, files):
+    os.makedirs(work, exist_ok=True)
+    if os.path.isdir(folder):
+        # 再インストール時は古いフォルダと入れ替える
+        swap_folder(work, folder)
+    else:
+        os.replace(work, folder)
+    return [os.path.join(folder, os.path.relpath(p, work)) for p in files]
+
+
+def _verify(digest, length, sha256, size):
+    if size is not None and length != int(size):
+        raise IntegrityError(f"サイズが一致しません: {length} != {size}")
+    if sha256 and digest != sha256.lower():
+        raise IntegrityError("SHA-256 が一致しません")
+
+
+# インストール済みアプリの台帳（パス・バージョン・サイズ）
+# 起動時に一度だけ読み込み、インストールと削除のたびに更新する
+class InstallRegistry:
+    def __init__(self, path=REGISTRY_PATH, root=None):
+        self.path = path
+        self.root = os.path.abspath(root or os.getcwd())
+        self.entries = {}
+        self.exists = False
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+            self.exists = True
+        except (OSError, ValueError):
+            self.entries = {}
+        return self
+
+    # 書き出しと置き換えもまとめて排他し、古い内容で上書きしないようにする
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps(self.entries, ensure_ascii=False, indent=1)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+            self.exists = True
+
+    def key(self, folder):
+        return os.path.normcase(os.path.abspath(os.path.join(self.root, folder)))
+
+    def is_installed(self, folder):
+        return self.key(folder) in self.entries
+
+    def get(self, folder):
+        return self.entries.get(self.key(folder))
+
+    # インストール済みで、カタログのバージョンと異なる（バージョン不明も含む）
+    def outdated(self, folder, version):
+        entry = self.get(folder)
+        return bool(entry and version and entry.get('version') != version)
+
+    def add(self, folder, title=None, version=None, url=None, size=None, files=None):
+        with self._lock:
+            self.entries[self.key(folder)] = {
+                'folder': folder,
+                'title': title,
+                'version': version,
+                'url': url,
+                'size': size,
+                'files': files,
+                'installed_at': time.time(),
+            }
+        self.save()
+
+    def remove(self, folder):
+        with self._lock:
+            removed = self.entries.pop(self.key(folder), None)
+        if removed is not None:
+            self.save()
+
+    # インストール先を一度だけ走査して、外部で追加・削除されたフォルダを反映する
+    # 台帳が変わったら True を返す
+    def reconcile(self, folders):
+        try:
+            names = {os.path.normcase(e.name) for e in os.scandir(self.root) if e.is_dir()}
+        except OSError:
+            return False
+        changed = False
+        with self._lock:
+            for key, entry in list(self.entries.items()):
+                if os.path.dirname(key) != os.path.normcase(self.root):
+                    continue
+                if os.path.normcase(os.path.basename(key)) not in names:
+                    del self.entries[key]
+                    changed = True
+            for folder in folders:
+                key = self.key(folder)
+                if key in self.entries:
+                    continue
+                if os.path.dirname(key) == os.path.normcase(self.root):
+                    found = os.path.normcase(os.path.basename(key)) in names
+                else:
+                    found = os.path.isdir(key)
+                if found:
+                    self.entries[key] = {'folder': folder, 'title': None, 'version': None,
+                                         'url': None, 'size': None, 'files': None,
+                                         'installed_at': None}
+                    changed = True
+        if changed:
+            self.save()
+        return changed
+
+
+# キャンセル時に途中のダウンロードと作業フォルダを片付ける
+def discard_install(folder):
+    zip_path = folder + ".zip"
+    discard_partial(zip_path)
+    if os.path.exists(zip_path):
+        os.remove(zip_path)
+    if os.path.isdir(folder + ".installing"):
+        shutil.rmtree(folder + ".installing", ignore_errors=True)
+    discard_update(folder)
+
+
+# 入れ替え済みのアプリをマニフェストとの差分だけで更新する
+def update_install(manifest_url, folder, on_progress=None, on_status=None, control=None):
+    _status(on_status, "マニフェストを取得中...")
+    manifest = fetch_manifest(manifest_url)
+    apply_update(manifest, folder, on_progress=on_progress, on_status=on_status, control=control)
+    return [os.path.join(folder, *rel.split('/')) for rel in manifest['files']]
+
+
+class InstallJob:
+    def __init__(self, url, folder, title=None, priority=0, rate_limit=0, version=None,
+                 sha256=None, size=None, manifest=None):
+        self.url = url
+        self.folder = folder
+        self.version = version
+        self.sha256 = sha256
+        self.size = size
+        self.manifest = manifest
+        self.title = title or os.path.basename(folder)
+        self.priority = priority
+        self.limiter = RateLimiter(rate_limit)
+        self.state = QUEUED
+        self.message = ""
+        self.downloaded = 0
+        self.total = 0
+        self.error = None
+        self.control = None
+        self._token = None
+        self._pause_requested = False
+
+    @property
+    def active(self):
+        return self.state in (QUEUED, RUNNING, PAUSED)
+
+
+# 上限付きのワーカーでインストールを順番に処理するキュー
+# priority が大きいジョブから開始し、全体と各ジョブの帯域を制限できる
+# on_update(job) は状態が変わったときにワーカースレッドから呼ばれる
+# 受信バイト数は job.downloaded / job.total を直接更新するだけなので、表示側で定期的に読む
+class InstallQueue:
+    def __init__(self, workers=MAX_PARALLEL_INSTALLS, rate_limit=0, on_update=None, registry=None,
+                 store=None):
+        self.limiter = RateLimiter(rate_limit)
+        self.registry = registry
+        self.store = store
+        self.on_update = on_update
+        self.jobs = []
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        for _ in range(max(1, workers)):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def find(self, folder):
+        for job in self.jobs:
+            if job.folder == folder and job.active:
+                return job
+        return None
+
+    # manifest を渡すとインストール済みのフォルダを差分更新する
+    def submit(self, url, folder, title=None, priority=0, rate_limit=0, version=None,
+               sha256=None, size=None, manifest=None):
+        with self._cond:
+            job = self.find(folder)
+            if job:
+                return job
+            job = InstallJob(url, folder, title, priority, rate_limit, version, sha256, size, manifest)
+            self.jobs.append(job)
+            self._push(job)
+        self._update(job)
+        return job
+
+    def set_rate_limit(self, rate):
+        self.limiter.set_rate(rate)
+
+    def prioritize(self, job):
+        with self._cond:
+            job.priority = max(j.priority for j in self.jobs) + 1
+            if job.state == QUEUED:
+                self._push(job)
+
+    def pause(self, job):
+        with self._cond:
+            if job.state == QUEUED:
+                job.state = PAUSED
+                job._token = None
+            elif job.state == RUNNING:
+                job._pause_requested = True
+                job.control.cancel()
+                return
+            else:
+                return
+        self._update(job)
+
+    def resume(self, job):
+        with self._cond:
+            if job.state not in (PAUSED, FAILED):
+                return
+            job.state = QUEUED
+            job.error = None
+            self._push(job)
+        self._update(job)
+
+    def cancel(self, job):
+        with self._cond:
+            if job.state == RUNNING:
+                job.control.cancel()
+                return
+            if job.state not in (QUEUED, PAUSED, FAILED):
+                return
+            job.state = CANCELED
+            job._token = None
+        discard_install(job.folder)
+        self._update(job)
+
+    def clear_finished(self):
+        with self._cond:
+            self.jobs = [j for j in self.jobs if j.active or j.state == FAILED]
+
+    def _push(self, job):
+        job._token = next(self._seq)
+        heapq.heappush(self._heap, (-job.priority, job._token, job))
+        self._cond.notify()
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                while self._heap:
+                    _, token, job = heapq.heappop(self._heap)
+                    # 優先度変更や一時停止で古くなったエントリは読み飛ばす
+                    if job._token == token and job.state == QUEUED:
+                        job.state = RUNNING
+                        job._pause_requested = False
+                        job.control = DownloadControl([job.limiter, self.limiter])
+                        return job
+                self._cond.wait()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            job.message = ""
+            self._update(job)
+            on_progress = lambda d, t, j=job: self._progress(j, d, t)
+            on_status = lambda text, j=job: self._status(j, text)
+            try:
+                with trace_core.span('install.job', title=job.title, folder=job.folder):
+                    if job.manifest and os.path.isdir(job.folder):
+                        files = update_install(job.manifest, job.folder, on_progress=on_progress,
+                                               on_status=on_status, control=job.control)
+                    else:
+                        files = download_and_install(job.url, job.folder, on_progress=on_progress,
+                                                     on_status=on_status, control=job.control,
+                                                     sha256=job.sha256, size=job.size, store=self.store)
+                if files is not None and self.registry is not None:
+                    size = sum(os.path.getsize(p) for p in files)
+                    self.registry.add(job.folder, title=job.title, version=job.version,
+                                      url=job.url, size=size, files=len(files))
+                state = DONE
+            except Exception as e:
+                if job._pause_requested:
+                    state = PAUSED
+                elif job.control.canceled.is_set():
+                    discard_install(job.folder)
+                    state = CANCELED
+                else:
+                    job.error = e
+                    state = FAILED
+            with self._cond:
+                job.state = state
+            self._update(job)
+
+    def _progress(self, job, downloaded, total):
+        job.downloaded = downloaded
+        job.total = total
+
+    def _status(self, job, text):
+        job.message = text
+        self._update(job)
+
+    def _update(self, job):
+        if self.on_update:
+            self.on_update(job)
+
+
+def _status(cb, text):
+    if cb:
+        cb(text)
+
+
+def _zip64_field(extra):
+    i = 0
+    while i + 4 <= len(extra):
+        tag, size = struct.unpack_from('<HH', extra, i)
+        if tag == 0x0001:
+            return extra[i + 4:i + 4 + size]
+        i += 4 + size
+    return None
+
+
+def _has_zip64(extra):
+    return _zip64_field(extra) is not None
+
+
+def _zip64_sizes(extra, usize, csize):
+    data = _zip64_field(extra)
+    if data is None:
+        raise StreamUnsupported("Zip64の拡張フィールドがありません")
+    j = 0
+    if usize == ZIP64_LIMIT:
+        usize = struct.unpack_from('<Q', data, j)[0]
+        j += 8
+    if csize == ZIP64_LIMIT:
+        csize = struct.unpack_from('<Q', data, j)[0]
+    return usize, csize
+
+
+def _dos_time(d, t):
+    try:
+        return time.mktime(((d >> 9) + 1980, (d >> 5) & 0xF, d & 0x1F,
+                            t >> 11, (t >> 5) & 0x3F, (t & 0x1F) * 2, 0, 0, -1))
+    except (OverflowError, ValueError):
+        return time.time()
@@ -1,54 +1,240 @@
 import sys
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QPlainTextEdit
-from PyQt5.QtGui import QTextCursor
+import threading
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import (
+    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPlainTextEdit, QPushButton, QLabel,
+    QFileDialog, QMessageBox
+)
+from PyQt5.QtGui import QKeySequence, QTextCursor
 import re
+from isbn_core import ISBN_PREFIXES, FULLWIDTH, validate_file_batches
+
+REPORT_LINES = 20
+NON_DIGIT = re.compile(r'[^0-9]')
+
+
+# 数字を13桁ずつに区切り、許可された先頭のものだけ残す
+# (区切った塊の一覧（先頭が不正なら None）, 13桁に満たない残り) を返す
+def split_codes(digits):
+    chunks = []
+    i = 0
+    while i + 13 <= len(digits):
+        chunk = digits[i:i+13]
+        chunks.append(chunk if chunk.startswith(ISBN_PREFIXES) else None)
+        i += 13
+    return chunks, digits[i:]
+
+
+# キー入力と貼り付けを編集ブロックにまとめ、続く整形を同じ取り消し単位に入れられるようにする
+# 続けて打った文字は Qt の標準と同じく1つの取り消し単位にまとめる
+class CodeEdit(QPlainTextEdit):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._typed = None  # 直前に打った文字の後の (カーソル位置, 取り消し段数)
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.Undo) or event.matches(QKeySequence.Redo):
+            self._typed = None
+            super().keyPressEvent(event)
+            return
+        doc = self.document()
+        cursor = self.textCursor()
+        typing = (event.text().isprintable() and bool(event.text()) and not cursor.hasSelection()
+                  and not event.modifiers() & (Qt.ControlModifier | Qt.AltModifier))
+        if typing and self._typed == (cursor.position(), doc.availableUndoSteps()):
+            cursor.joinPreviousEditBlock()
+        else:
+            cursor.beginEditBlock()
+        try:
+            super().keyPressEvent(event)
+        finally:
+            cursor.endEditBlock()
+        self._typed = (self.textCursor().position(), doc.availableUndoSteps()) if typing else None
+
+    def insertFromMimeData(self, source):
+        self._typed = None
+        cursor = self.textCursor()
+        cursor.beginEditBlock()
+        try:
+            super().insertFromMimeData(source)
+        finally:
+            cursor.endEditBlock()
+
 
 class ISBNInputWidget(QWidget):
+    imported = pyqtSignal(object, object, object)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("ISBN入力（978,979,977のみ許可）")
         self.resize(350, 250)
 
-        self.text_edit = QPlainTextEdit(self)
+        self.text_edit = CodeEdit(self)
+        # 変更のあった範囲だけを覚えておき、textChanged でその行だけ整形する
+        doc = self.text_edit.document()
+        doc.contentsChange.connect(self.on_contents_change)
+        doc.undoCommandAdded.connect(self.on_command_added)
         self.text_edit.textChanged.connect(self.on_text_changed)
         self._updating = False  # 無限ループ防止
+        self._dirty = None
+        # 取り消し・やり直しの再生中は整形しない（新しい編集なら undoCommandAdded が先に来るか、
+        # 直前の編集に結合されて取り消し・やり直しの段数が変わらない）
+        self._added = False
+        self._steps = (0, 0)
+
+        # ファイルの読み込みと検証は別スレッドで行い、結果だけをシグナルで受け取る
+        self.import_button = QPushButton("ファイルから読み込み")
+        self.import_button.clicked.connect(self.import_file)
+        self.status = QLabel()
+        self.imported.connect(self.on_imported)
 
         layout = QVBoxLayout()
         layout.addWidget(self.text_edit)
+        bottom = QHBoxLayout()
+        bottom.addWidget(self.import_button)
+        bottom.addWidget(self.status, 1)
+        layout.addLayout(bottom)
         self.setLayout(layout)
 
-    def on_text_changed(self):
+    def import_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "ISBNリストを開く", "",
+                                              "テキスト / CSV (*.txt *.csv *.tsv);;すべて (*)")
+        if not path:
+            return
+        # 入力済みのコードとも重複を取り除く
+        seen = set(self.text_edit.toPlainText().split('\n'))
+        self.import_button.setEnabled(False)
+        self.status.setText("読み込み中...")
+        threading.Thread(target=self._validate, args=(path, seen), daemon=True).start()
+
+    def _validate(self, path, seen):
+        codes, errors = [], []
+        try:
+            for batch in validate_file_batches(path, seen=seen):
+                for r in batch:
+                    if r.error is None:
+                        codes.append(r.code)
+                    else:
+                        errors.append(r)
+        except Exception as e:  # 失敗してもボタンを戻せるよう必ず通知する
+            self.imported.emit(path, None, e)
+            return
+        self.imported.emit(path, codes, errors)
+
+    def on_imported(self, path, codes, errors):
+        self.import_button.setEnabled(True)
+        if codes is None:
+            self.status.setText("")
+            QMessageBox.critical(self, "読み込み失敗", str(errors))
+            return
+        if codes:
+            cursor = self.text_edit.textCursor()
+            cursor.movePosition(QTextCursor.End)
+            prefix = '\n' if cursor.block().text() else ''
+            cursor.beginEditBlock()
+            cursor.insertText(prefix + '\n'.join(codes))
+            cursor.endEditBlock()
+            self.text_edit.setTextCursor(cursor)
+        duplicates = sum(1 for r in errors if r.code)
+        self.status.setText(f"追加: {len(codes)}  不正: {len(errors) - duplicates}  重複: {duplicates}")
+        invalid = [r for r in errors if not r.code]
+        if invalid:
+            lines = [f"{r.line}行 {r.column}文字目: {r.text}（{r.error}）" for r in invalid[:REPORT_LINES]]
+            if len(invalid) > REPORT_LINES:
+                lines.append(f"...ほか {len(invalid) - REPORT_LINES} 件")
+            QMessageBox.warning(self, "不正なコード", "\n".join(lines))
+
+    def on_contents_change(self, position, removed, added):
         if self._updating:
             return
+        end = position + added
+        if self._dirty:
+            position = min(position, self._dirty[0])
+            end = max(end, self._dirty[1])
+        self._dirty = (position, end)
 
-        original_text = self.text_edit.toPlainText()
-        digits_only = re.sub(r'\D', '', original_text)  # 数字だけ抽出
+    def on_command_added(self):
+        if not self._updating:
+            self._added = True
 
-        valid_chunks = []
-        i = 0
-        while i + 13 <= len(digits_only):
-            chunk = digits_only[i:i+13]
-            if chunk.startswith(('978', '979', '977')):
-                valid_chunks.append(chunk)
-            i += 13
+    def on_text_changed(self):
+        if self._updating:
+            return
+        doc = self.text_edit.document()
+        steps = (doc.availableUndoSteps(), doc.availableRedoSteps())
+        replaying = not self._added and steps != self._steps
+        self._added = False
+        self._steps = steps
+        if replaying or self._dirty is None:
+            self._dirty = None
+            return
+        position, end = self._dirty
+        self._dirty = None
+
+        # 変更範囲を含む行全体を取り出す
+        first = doc.findBlock(position)
+        last = doc.findBlock(min(end, doc.characterCount() - 1))
+        if not first.isValid():
+            first = doc.firstBlock()
+        if not last.isValid():
+            last = doc.lastBlock()
+        start = first.position()
+        stop = last.position() + last.length() - 1
+        lines = []
+        block = first
+        while block.isValid():
+            lines.append(block.text())
+            if block == last:
+                break
+            block = block.next()
+        original_text = '\n'.join(lines)
 
-        # 残りの未確定入力（13桁に満たない最後の部分）
-        remainder = digits_only[i:]
+        digits_only = NON_DIGIT.sub('', original_text.translate(FULLWIDTH))  # 数字だけ抽出（全角は半角に）
+        chunks, remainder = split_codes(digits_only)
+        valid_chunks = [c for c in chunks if c]
 
         # 改行で区切って再構成（最後に未確定の数字が続く場合はそのまま）
         new_text = '\n'.join(valid_chunks)
         if remainder:
-            new_text += '\n' + remainder
+            new_text += ('\n' if new_text else '') + remainder
+        if new_text == original_text:
+            return
 
-        if new_text != original_text:
-            cursor = self.text_edit.textCursor()
-            pos = cursor.position()
-            self._updating = True
-            self.text_edit.setPlainText(new_text)
-            # カーソル再配置（末尾へ）
-            cursor.setPosition(len(new_text))
-            self.text_edit.setTextCursor(cursor)
-            self._updating = False
+        # 入力位置より前にあった数字の数から、整形後のカーソル位置を求める
+        cursor = self.text_edit.textCursor()
+        pos = cursor.position()
+        if start <= pos <= stop:
+            before = len(NON_DIGIT.sub('', original_text[:pos - start].translate(FULLWIDTH)))
+            pos = start + self._map_position(before, chunks, remainder)
+        elif pos > stop:
+            pos += len(new_text) - len(original_text)
+
+        # 文書全体は置き換えず、該当範囲だけを直前の編集と同じ取り消し単位で書き換える
+        self._updating = True
+        edit = QTextCursor(doc)
+        edit.joinPreviousEditBlock()
+        edit.setPosition(start)
+        edit.setPosition(stop, QTextCursor.KeepAnchor)
+        edit.insertText(new_text)
+        edit.endEditBlock()
+        cursor.setPosition(min(pos, doc.characterCount() - 1))
+        self.text_edit.setTextCursor(cursor)
+        self._steps = (doc.availableUndoSteps(), doc.availableRedoSteps())
+        self._updating = False
+
+    @staticmethod
+    def _map_position(before, chunks, remainder):
+        offset = 0
+        consumed = 0
+        for chunk in chunks + [remainder]:
+            size = 13 if chunk is None else len(chunk)
+            if chunk is not None and before <= consumed + size:
+                # 直前の塊が取り除かれていた場合は、この塊の先頭に置く
+                return offset + max(0, before - consumed)
+            if chunk is not None:
+                offset += size + 1
+            consumed += size
+        return max(0, offset - 1)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
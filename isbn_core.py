@@ -0,0 +1,201 @@
+import re
+import sys
+import csv
+import argparse
+from collections import namedtuple
+
+# ISBN（978/979）と ISSN（977）の EAN-13
+ISBN_PREFIXES = ('978', '979', '977')
+BATCH_SIZE = 65536
+READ_BUFFER = 1024 * 1024
+MIN_CODE_DIGITS = 8
+# 数字（ハイフン区切り可、末尾はチェック用の X も可）の並び
+# 直前に英数字があれば対象外だが、「ISBN978-...」のように ISBN/ISSN が付いたものは拾う
+CODE = re.compile(r'(?:(?<=[Ii][Ss][Bb][Nn])|(?<=[Ii][Ss][Ss][Nn])|(?<![\dA-Za-z-]))'
+                  r'\d[\d-]*[\dXx](?![0-9A-Za-z])')
+# ハイフン区切りは ISBN（末尾がチェック用の1文字）か ISSN（4桁-4桁）の形だけを候補にする（日付や電話番号を除く）
+HYPHENATED = re.compile(r'.*-[\dXx]|\d{4}-\d{3}[\dXx]')
+DIGIT = re.compile(r'\d')
+# 全角数字は半角にそろえる（それ以外の数字は不正として扱う）
+FULLWIDTH = str.maketrans('０１２３４５６７８９Ｘｘ', '0123456789Xx')
+
+# line/column は 1 始まり。code は正規化した13桁、error は不正・重複の理由
+Result = namedtuple('Result', 'line column text code error')
+
+# 2桁ずつ重み (1, 3) を掛けた和の表（EAN-13 のチェックを1桁ずつ計算しないため）
+_PAIR_SUM = {f"{a}{b}": a + b * 3 for a in range(10) for b in range(10)}
+
+
+def ean13_check(digits12):
+    p = _PAIR_SUM
+    s = (p[digits12[0:2]] + p[digits12[2:4]] + p[digits12[4:6]]
+         + p[digits12[6:8]] + p[digits12[8:10]] + p[digits12[10:12]])
+    return str((10 - s % 10) % 10)
+
+
+# まとめて検証する（1件ずつの関数呼び出しより速い）
+def ean13_valid_batch(codes):
+    p = _PAIR_SUM
+    return [(p[c[0:2]] + p[c[2:4]] + p[c[4:6]] + p[c[6:8]] + p[c[8:10]] + p[c[10:12]]
+             + ord(c[12]) - 48) % 10 == 0 for c in codes]
+
+
+def isbn10_valid(code):
+    if not code[:9].isdigit():
+        return False
+    last = 10 if code[9] in 'Xx' else int(code[9])
+    return (sum((10 - i) * int(c) for i, c in enumerate(code[:9])) + last) % 11 == 0
+
+
+def isbn10_to_13(code):
+    body = '978' + code[:9]
+    return body + ean13_check(body)
+
+
+def issn_valid(code):
+    if not code[:7].isdigit():
+        return False
+    last = 10 if code[7] in 'Xx' else int(code[7])
+    return (sum((8 - i) * int(c) for i, c in enumerate(code[:7])) + last) % 11 == 0
+
+
+def issn_to_ean13(code):
+    body = '977' + code[:7] + '00'
+    return body + ean13_check(body)
+
+
+# 1件を13桁に正規化する。(コード, None) か (None, 理由) を返す
+# 13桁はチェックディジットを後でまとめて確認するので、ここでは形式だけ見る
+def normalize(token, prefixes=ISBN_PREFIXES):
+    digits = token.translate(FULLWIDTH).replace('-', '')
+    if not digits.isascii():
+        return None, "数字以外を含みます"
+    n = len(digits)
+    if n == 13:
+        if not digits.isdigit():
+            return None, "数字以外を含みます"
+        if not digits.startswith(prefixes):
+            return None, "先頭が対象外です"
+        return digits, None
+    if n == 10:
+        if not isbn10_valid(digits):
+            return None, "ISBN-10 のチェックディジットが不正です"
+        code = isbn10_to_13(digits)
+    elif n == 8:
+        if not issn_valid(digits):
+            return None, "ISSN のチェックディジットが不正です"
+        code = issn_to_ean13(digits)
+    else:
+        return None, f"桁数が不正です ({n}桁)"
+    if not code.startswith(prefixes):
+        return None, "先頭が対象外です"
+    return code, None
+
+
+# 各行から (行番号, 桁位置, 文字列) を取り出す
+# column を指定すると CSV のその列（1 始まり）だけを見る
+def scan(lines, column=None, delimiter=','):
+    if column is None:
+        for n, line in enumerate(lines, 1):
+            for m in CODE.finditer(line):
+                text = m.group()
+                if len(text) - text.count('-') >= MIN_CODE_DIGITS and (
+                        '-' not in text or HYPHENATED.fullmatch(text)):
+                    yield n, m.start() + 1, text
+        return
+    reader = csv.reader(lines, delimiter=delimiter)
+    for row in reader:
+        n = reader.line_num
+        if len(row) < column:
+            continue
+        # 見出し行など数字を含まない欄は読み飛ばす
+        text = row[column - 1].strip()
+        if DIGIT.search(text):
+            yield n, column, text
+
+
+# 行を読みながら検証し、Result の一覧を BATCH_SIZE 件ずつ入力順に返す
+# 13桁のチェックディジットは一覧ごとにまとめて確認する
+# seen を渡すと複数ファイルをまたいで重複を判定できる
+def validate_batches(lines, prefixes=ISBN_PREFIXES, column=None, delimiter=',', dedupe=True,
+                     batch_size=BATCH_SIZE, seen=None):
+    seen = set() if seen is None else seen
+    batch = []
+    for n, col, text in scan(lines, column, delimiter):
+        code, error = normalize(text, prefixes)
+        batch.append(Result(n, col, text, code, error))
+        if len(batch) >= batch_size:
+            yield _check(batch, dedupe, seen)
+            batch = []
+    if batch:
+        yield _check(batch, dedupe, seen)
+
+
+def _check(batch, dedupe, seen):
+    oks = iter(ean13_valid_batch([r.code for r in batch if r.code]))
+    results = []
+    for r in batch:
+        if r.code is not None:
+            if not next(oks):
+                r = r._replace(code=None, error="チェックディジットが不正です")
+            elif dedupe and r.code in seen:
+                r = r._replace(error="重複しています")
+            else:
+                seen.add(r.code)
+        results.append(r)
+    return results
+
+
+def open_lines(path, encoding='utf-8-sig'):
+    if path == '-':
+        return sys.stdin
+    return open(path, encoding=encoding, errors='replace', newline='', buffering=READ_BUFFER)
+
+
+def validate_file_batches(path, encoding='utf-8-sig', **kwargs):
+    with open_lines(path, encoding) as f:
+        yield from validate_batches(f, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="isbn_core", description="ISBN/ISSN の一括検証")
+    parser.add_argument('files', nargs='+', help="テキスト / CSV ファイル（- は標準入力）")
+    parser.add_argument('-o', '--output', help="正しいコードの出力先（省略時は標準出力）")
+    parser.add_argument('--errors', help="不正な行の一覧 (TSV) の出力先（省略時は標準エラー）")
+    parser.add_argument('--column', type=int, help="CSV のこの列（1 始まり）だけを見る")
+    parser.add_argument('--delimiter', default=',', help="CSV の区切り文字")
+    parser.add_argument('--encoding', default='utf-8-sig')
+    parser.add_argument('--prefix', default=','.join(ISBN_PREFIXES), help="許可する先頭（カンマ区切り）")
+    parser.add_argument('--keep-duplicates', action='store_true', help="重複を取り除かない")
+    args = parser.parse_args(argv)
+
+    prefixes = tuple(p for p in args.prefix.split(',') if p)
+    out = open(args.output, 'w', encoding='utf-8', newline='\n') if args.output else sys.stdout
+    err = open(args.errors, 'w', encoding='utf-8', newline='\n') if args.errors else sys.stderr
+    counts = {'valid': 0, 'invalid': 0, 'duplicate': 0}
+    seen = set()
+    try:
+        for path in args.files:
+            for batch in validate_file_batches(path, args.encoding, prefixes=prefixes,
+                                               column=args.column, delimiter=args.delimiter,
+                                               dedupe=not args.keep_duplicates, seen=seen):
+                codes = [r.code for r in batch if r.error is None]
+                if codes:
+                    out.write("\n".join(codes) + "\n")
+                counts['valid'] += len(codes)
+                for r in batch:
+                    if r.error is not None:
+                        counts['duplicate' if r.code else 'invalid'] += 1
+                        err.write(f"{path}:{r.line}:{r.column}\t{r.text}\t{r.error}\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if err is not sys.stderr:
+            err.close()
+    print(f"正常: {counts['valid']}  不正: {counts['invalid']}  重複: {counts['duplicate']}",
+          file=sys.stderr)
+    return 1 if counts['invalid'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
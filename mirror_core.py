@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import net_core
+from catalog_core import DATA_DIR
+
+# 同じ内容を配信しているサーバー（先頭が既定）。
+# ~/.hijikinoheya/mirrors.json か環境変数 HIJIKINOHEYA_MIRRORS（カンマ区切り）で追加できる
+MIRRORS = ["https://home.hijikinoheya.com/"]
+MIRRORS_PATH = os.path.join(DATA_DIR, "mirrors.json")
+PROBE_PATH = "app/app.json"
+PROBE_TIMEOUT = 5
+RETRY_FAILED_AFTER = 300
+
+
+def configured_mirrors():
+    bases = list(MIRRORS)
+    try:
+        with open(MIRRORS_PATH, encoding='utf-8') as f:
+            extra = json.load(f)
+    except (OSError, ValueError):
+        extra = []
+    # 文字列の一覧でなければ無視する（設定の誤りで取得できなくならないように）
+    if isinstance(extra, list):
+        bases += [b for b in extra if isinstance(b, str) and b.strip()]
+    bases += [b for b in os.environ.get("HIJIKINOHEYA_MIRRORS", "").replace(" ", ",").split(",") if b]
+    seen = []
+    for base in bases:
+        base = base if base.endswith('/') else base + '/'
+        if base not in seen:
+            seen.append(base)
+    return seen
+
+
+# ミラーごとの応答時間・実測速度・失敗時刻を覚えておき、速い順に並べる
+class MirrorSet:
+    def __init__(self, bases=None):
+        self.bases = bases or configured_mirrors()
+        self.latency = {}
+        self.speed = {}
+        self.failed = {}
+        self._lock = threading.Lock()
+
+    # 全ミラーへ同時に小さな要求を送り、応答までの時間を測る
+    def probe(self, path=PROBE_PATH):
+        if len(self.bases) < 2:
+            return self.ranked()
+        with ThreadPoolExecutor(len(self.bases)) as pool:
+            for base, latency in zip(self.bases, pool.map(lambda b: self._probe(b + path), self.bases)):
+                with self._lock:
+                    if latency is None:
+                        self.failed[base] = time.monotonic()
+                    else:
+                        self.latency[base] = latency
+                        self.failed.pop(base, None)
+        return self.ranked()
+
+    def _probe(self, url):
+        start = time.monotonic()
+        try:
+            resp = net_core.get(url, headers={'Range': 'bytes=0-0'}, stream=True, compress=False,
+                                timeout=PROBE_TIMEOUT)
+            resp.close()
+            if resp.status_code >= 400:
+                return None
+        except Exception:
+            return None
+        return time.monotonic() - start
+
+    def ranked(self):
+        now = time.monotonic()
+        with self._lock:
+            def score(base):
+                down = now - self.failed.get(base, -RETRY_FAILED_AFTER) < RETRY_FAILED_AFTER
+                return (down, -self.speed.get(base, 0), self.latency.get(base, float('inf')),
+                        self.bases.index(base))
+            return sorted(self.bases, key=score)
+
+    def base_of(self, url):
+        for base in self.bases:
+            if url.startswith(base):
+                return base
+        return None
+
+    # url と同じファイルを指す各ミラーのURL（速い順）。ミラー外のURLはそのまま
+    def candidates(self, url):
+        base = self.base_of(url)
+        if base is None:
+            return [url]
+        rel = url[len(base):]
+        return [b + rel for b in self.ranked()]
+
+    def mark_failed(self, url):
+        base = self.base_of(url)
+        if base:
+            with self._lock:
+                self.failed[base] = time.monotonic()
+
+    # ダウンロードで実測した速度（バイト/秒）を反映する
+    def record_speed(self, url, speed):
+        base = self.base_of(url)
+        if base and speed > 0:
+            with self._lock:
+                old = self.speed.get(base)
+                self.speed[base] = speed if old is None else (old + speed) / 2
+
+
+_mirrors = None
+_lock = threading.Lock()
+
+
+def mirrors():
+    global _mirrors
+    with _lock:
+        if _mirrors is None:
+            _mirrors = MirrorSet()
+        return _mirrors
+
+
+# 速い順にミラーを試し、最初に取得できた応答を返す
+# 404 はそのミラーにファイルがまだ無いだけとみなし、残りのミラーを試す（最後の1つならそのまま返す）
+def get_mirrored(url, **kwargs):
+    ms = mirrors()
+    error = None
+    candidates = ms.candidates(url)
+    for i, candidate in enumerate(candidates):
+        try:
+            resp = net_core.get(candidate, **kwargs)
+        except Exception as e:
+            error = e
+            ms.mark_failed(candidate)
+            continue
+        if resp.status_code < 500 and (resp.status_code != 404 or i == len(candidates) - 1):
+            return resp
+        # stream=True の応答は閉じないと接続がプールに戻らない
+        resp.close()
+        error = net_core._requests().HTTPError(f"{resp.status_code} {candidate}", response=resp)
+        if resp.status_code >= 500:
+            ms.mark_failed(candidate)
+    raise error
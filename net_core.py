@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+# 通信設定（カタログ・マニフェスト・パッケージで共通）
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+RETRIES = 3
+BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+POOL_SIZE = 16
+# 環境変数 HTTP_PROXY / HTTPS_PROXY も使われる。アプリ専用に指定する場合はこちら
+PROXY = os.environ.get("HIJIKINOHEYA_PROXY")
+USER_AGENT = "HijikinoheyaAppDownloader"
+
+_session = None
+_lock = threading.Lock()
+
+
+def _requests():
+    # requests は読み込みが重いので最初の通信時に読み込む
+    import requests
+    return requests
+
+
+# 接続を使い回す共有セッション（接続失敗や 5xx は指数バックオフで再試行する）
+def session():
+    global _session
+    with _lock:
+        if _session is None:
+            requests = _requests()
+            from urllib3.util.retry import Retry
+            retry = Retry(total=RETRIES, connect=RETRIES, read=RETRIES, status=RETRIES,
+                          backoff_factor=BACKOFF, status_forcelist=RETRY_STATUS,
+                          allowed_methods=frozenset(['GET', 'HEAD']), raise_on_status=False)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                                                    max_retries=retry)
+            s = requests.Session()
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            s.headers['User-Agent'] = USER_AGENT
+            if PROXY:
+                s.proxies = {'http': PROXY, 'https': PROXY}
+            _session = s
+        return _session
+
+
+# compress=False はパッケージ用（Range のオフセットがずれないよう圧縮させない）
+def get(url, headers=None, stream=False, compress=True, timeout=None):
+    headers = dict(headers or {})
+    headers['Accept-Encoding'] = 'gzip, deflate' if compress else 'identity'
+    return session().get(url, headers=headers, stream=stream,
+                         timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+
+# stream=True の応答はエラー時も閉じて、接続をプールへ返す
+def raise_for_status(resp):
+    try:
+        resp.raise_for_status()
+    except Exception:
+        resp.close()
+        raise
+    return resp
+
+
+# 受信途中の切断など、セッションの再試行では拾えない失敗を呼び出し側で再試行する
+def transient(error):
+    requests = _requests()
+    return isinstance(error, (requests.ConnectionError, requests.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+def network_error(error):
+    return isinstance(error, _requests().RequestException)
+
+
+def backoff(attempt):
+    time.sleep(BACKOFF * (2 ** attempt))
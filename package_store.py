@@ -0,0 +1,93 @@
+import os
+import hashlib
+import shutil
+from catalog_core import DATA_DIR
+
+# 複数ユーザーで共有する場合は環境変数で共通の場所を指定する
+STORE_DIR = os.environ.get("HIJIKINOHEYA_PACKAGE_STORE") or os.path.join(DATA_DIR, "packages")
+STORE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+HASH_CHUNK = 1024 * 1024
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# app.json の sha256 をキーにしたパッケージ置き場（容量を超えたら古いものから削除）
+class PackageStore:
+    def __init__(self, root=STORE_DIR, max_bytes=STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path(self, digest):
+        digest = digest.lower()
+        return os.path.join(self.root, digest[:2], digest + ".zip")
+
+    def get(self, digest):
+        path = self.path(digest)
+        if not os.path.isfile(path):
+            return None
+        try:
+            # 最終利用時刻として mtime を更新する
+            os.utime(path)
+        except OSError:
+            pass  # 共有の置き場では他のユーザーのファイルの時刻は変えられない
+        return path
+
+    # 壊れていたものを取り除く（削除できなくても次の add で置き換わる）
+    def discard(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except OSError:
+            pass
+
+    def add(self, src, digest):
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.replace(src, tmp)
+        except OSError:
+            # 別ドライブなどで移動できない場合はコピーする
+            shutil.copyfile(src, tmp)
+            os.remove(src)
+        try:
+            os.chmod(tmp, 0o664)
+        except OSError:
+            pass
+        os.replace(tmp, path)
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        items = []
+        try:
+            dirs = list(os.scandir(self.root))
+        except OSError:
+            return items
+        for d in dirs:
+            if not d.is_dir():
+                continue
+            for e in os.scandir(d.path):
+                if e.name.endswith(".zip"):
+                    st = e.stat()
+                    items.append((st.st_mtime, st.st_size, e.path))
+        return items
+
+    def evict(self, keep=None):
+        items = sorted(self.entries())
+        total = sum(size for _, size, _ in items)
+        for _, size, path in items:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
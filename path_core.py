@@ -0,0 +1,15 @@
+import os
+
+
+# Zip のメンバー名やマニフェストのキー（/ 区切りの相対パス）を dest 配下のパスにする
+# 親フォルダへの移動（..）やドライブ指定（C: など）を含む場合は None
+def safe_join(dest, name):
+    parts = [p for p in name.replace('\\', '/').split('/') if p not in ('', '.')]
+    if not parts or '..' in parts or any(':' in p for p in parts):
+        return None
+    return os.path.join(dest, *parts)
+
+
+# 絶対パスも認めない（マニフェストのキーなど、相対パスしか来ないはずのもの）
+def is_safe_relpath(name):
+    return not name.startswith(('/', '\\')) and safe_join('', name) is not None
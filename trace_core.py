@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import threading
+import functools
+from collections import deque
+
+# 計測は既定で無効（HIJIKINOHEYA_TRACE=1 か --trace、または診断ウィンドウで有効にする）
+# 無効のときは span() が何もしない共有オブジェクトを返すだけで済む
+TRACE_FLAG = "--trace"
+MAX_EVENTS = 200000
+
+enabled = bool(os.environ.get("HIJIKINOHEYA_TRACE"))
+_events = deque(maxlen=MAX_EVENTS)
+_origin = time.perf_counter()
+_pid = os.getpid()
+
+
+def enable(value=True):
+    global enabled
+    enabled = value
+
+
+def clear():
+    _events.clear()
+
+
+def _now_us():
+    return (time.perf_counter() - _origin) * 1e6
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc):
+        end = _now_us()
+        event = {'name': self.name, 'ph': 'X', 'ts': round(self.start, 1),
+                 'dur': round(end - self.start, 1), 'pid': _pid, 'tid': threading.get_ident()}
+        if self.args:
+            event['args'] = self.args
+        _events.append(event)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+# with span("名前"): ... の区間を Chrome トレースの完了イベントとして記録する
+def span(name, **args):
+    if not enabled:
+        return _NO_SPAN
+    return _Span(name, args)
+
+
+def traced(name=None):
+    def decorate(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _Span(label, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# 速度や遅延などの数値（Chrome トレースのカウンター）
+def counter(name, **values):
+    if enabled:
+        _events.append({'name': name, 'ph': 'C', 'ts': round(_now_us(), 1), 'pid': _pid,
+                        'tid': threading.get_ident(), 'args': values})
+
+
+def instant(name, **args):
+    if enabled:
+        _events.append({'name': name, 'ph': 'i', 's': 't', 'ts': round(_now_us(), 1), 'pid': _pid,
+                        'tid': threading.get_ident(), 'args': args})
+
+
+def events():
+    return list(_events)
+
+
+# chrome://tracing や Perfetto でそのまま開ける形式で書き出す
+def export(path):
+    data = {'traceEvents': events(), 'displayTimeUnit': 'ms'}
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+# 区間ごとの回数・合計・最大（ミリ秒）と、カウンターの最新値
+def summary():
+    spans = {}
+    counters = {}
+    for e in events():
+        if e['ph'] == 'X':
+            s = spans.setdefault(e['name'], {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            ms = e['dur'] / 1000
+            s['count'] += 1
+            s['total_ms'] += ms
+            s['max_ms'] = max(s['max_ms'], ms)
+        elif e['ph'] == 'C':
+            counters[e['name']] = e['args']
+    return spans, counters
@@ -0,0 +1,190 @@
+import os
+import json
+import hashlib
+import shutil
+from urllib.parse import urljoin, quote
+import trace_core
+from mirror_core import mirrors, get_mirrored
+from download_core import SegmentedDownloader, IntegrityError, DownloadError
+from package_store import hash_file
+from path_core import is_safe_relpath
+from catalog_core import DATA_DIR
+
+STATE_DIR = os.path.join(DATA_DIR, "manifests")
+
+
+# サーバー側のマニフェスト（app.json の manifest で指定）
+# {"version": "1.2.0", "base": "https://.../App/",
+#  "files": {"App.exe": {"sha256": "...", "size": 123, "url": "省略可"}, ...}}
+@trace_core.traced('update.fetch_manifest')
+def fetch_manifest(url):
+    resp = get_mirrored(url)
+    resp.raise_for_status()
+    manifest = resp.json()
+    check_manifest(manifest)
+    manifest.setdefault('base', url)
+    return manifest
+
+
+# キーはインストール先からの相対パスとして使うため、外へ出るものが1つでもあれば全体を拒否する
+def check_manifest(manifest):
+    files = manifest.get('files') if isinstance(manifest, dict) else None
+    if not isinstance(files, dict):
+        raise DownloadError("マニフェストの形式が不正です")
+    for rel in files:
+        if not is_safe_relpath(rel):
+            raise DownloadError(f"マニフェストに不正なパスがあります: {rel}")
+
+
+def file_url(manifest, rel):
+    entry = manifest['files'][rel]
+    return entry.get('url') or urljoin(manifest['base'], quote(rel))
+
+
+# 前回確認したファイルのハッシュを (サイズ, 更新時刻) と一緒に覚えておき、
+# 変わっていないファイルは読み直さない
+def state_file(folder):
+    key = os.path.normcase(os.path.abspath(folder))
+    return os.path.join(STATE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".json")
+
+
+def load_state(folder):
+    try:
+        with open(state_file(folder), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'files': {}}
+
+
+def save_state(folder, files):
+    path = state_file(folder)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'files': files}, f)
+    os.replace(tmp, path)
+
+
+def local_hash(folder, rel, cached):
+    path = os.path.join(folder, *rel.split('/'))
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    stamp = [st.st_size, st.st_mtime_ns]
+    if cached and cached[:2] == stamp:
+        return cached[2], stamp
+    return hash_file(path), stamp
+
+
+# マニフェストと手元のファイルを比べ、取得が必要なファイルと削除するファイルを返す
+# 削除するのは前回のマニフェストにあって今回なくなったファイルだけ（設定などは残す）
+@trace_core.traced('update.plan')
+def plan_update(folder, manifest, state=None):
+    state = state or load_state(folder)
+    known = state.get('files', {})
+    changed = []
+    for rel, entry in manifest['files'].items():
+        cached = known.get(rel)
+        path = os.path.join(folder, *rel.split('/'))
+        size = entry.get('size')
+        if size is not None and (not os.path.isfile(path) or os.path.getsize(path) != size):
+            changed.append(rel)
+            continue
+        digest, _ = local_hash(folder, rel, cached)
+        if digest != entry['sha256'].lower():
+            changed.append(rel)
+    removed = [rel for rel in known if rel not in manifest['files']]
+    return changed, removed
+
+
+# 変更のあったファイルだけを <folder>.updating へ取得し、検証できたら
+# 変更のないファイルをハードリンクした新しいフォルダと入れ替える
+@trace_core.traced('update.apply')
+def apply_update(manifest, folder, on_progress=None, on_status=None, control=None):
+    check_manifest(manifest)
+    staging = folder + ".updating"
+    work = folder + ".installing"
+    if on_status:
+        on_status("更新を確認中...")
+    changed, removed = plan_update(folder, manifest)
+    total = sum(manifest['files'][rel].get('size') or 0 for rel in changed)
+    done = 0
+    for rel in changed:
+        entry = manifest['files'][rel]
+        target = os.path.join(staging, *rel.split('/'))
+        if on_status:
+            on_status(f"差分を取得中: {rel}")
+        if entry.get('size') == 0:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            open(target, 'wb').close()
+        if not (os.path.isfile(target) and hash_file(target) == entry['sha256'].lower()):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            base = done
+
+            def progress(d, t, base=base):
+                if on_progress:
+                    on_progress(base + d, max(total, base + t))
+
+            SegmentedDownloader(file_url(manifest, rel), target, on_progress=progress,
+                                control=control, mirrors=mirrors()).run()
+            if hash_file(target) != entry['sha256'].lower():
+                os.remove(target)
+                raise IntegrityError(f"SHA-256 が一致しません: {rel}")
+        done += os.path.getsize(target)
+        if on_progress:
+            on_progress(done, max(total, done))
+    if on_status:
+        on_status("更新を適用中...")
+    replaced = set(changed) | set(removed)
+    if os.path.isdir(work):
+        shutil.rmtree(work)
+    _link_tree(folder, work, skip={os.path.join(*rel.split('/')) for rel in replaced})
+    for rel in changed:
+        dst = os.path.join(work, *rel.split('/'))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(os.path.join(staging, *rel.split('/')), dst)
+    swap_folder(work, folder)
+    shutil.rmtree(staging, ignore_errors=True)
+    # 適用後のハッシュを覚えておき、次回の比較で読み直さないようにする
+    files = {}
+    for rel, entry in manifest['files'].items():
+        path = os.path.join(folder, *rel.split('/'))
+        st = os.stat(path)
+        files[rel] = [st.st_size, st.st_mtime_ns, entry['sha256'].lower()]
+    save_state(folder, files)
+    return [os.path.join(folder, *rel.split('/')) for rel in changed]
+
+
+def _link_tree(src, dst, skip):
+    for root, dirs, names in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        os.makedirs(os.path.join(dst, rel_root), exist_ok=True)
+        for name in names:
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            if rel in skip:
+                continue
+            target = os.path.join(dst, rel)
+            try:
+                os.link(os.path.join(root, name), target)
+            except OSError:
+                shutil.copy2(os.path.join(root, name), target)
+
+
+# 作業フォルダを folder と入れ替える（途中で失敗したら元に戻す）
+def swap_folder(work, folder):
+    old = folder + ".old"
+    if os.path.isdir(old):
+        shutil.rmtree(old)
+    os.replace(folder, old)
+    try:
+        os.replace(work, folder)
+    except OSError:
+        os.replace(old, folder)
+        raise
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def discard_update(folder):
+    if os.path.isdir(folder + ".updating"):
+        shutil.rmtree(folder + ".updating", ignore_errors=True)